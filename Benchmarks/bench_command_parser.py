@@ -0,0 +1,84 @@
+import os
+import random
+import shlex
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Core.Util.CommandParser import parse_command
+
+''' Compares parse_command against the shlex.split based parsing MessageHandler.handle_command used to do, checking
+that both split every message the same way, and that whitespace after the command character never ends up in a command
+name. Run from the repository root: python Benchmarks/bench_command_parser.py [messages]'''
+
+
+def legacy_split(text):
+    line_args = shlex.split(text, posix=False)
+    i = 0
+    while i < len(line_args):
+        line_args[i] = line_args[i].strip()
+        if line_args[i] == '' or line_args[i] == '':
+            line_args.remove(line_args[i])
+        else:
+            i += 1
+    return line_args
+
+
+def make_messages(count, seed=0):
+    rng = random.Random(seed)
+    words = ['ping', 'define', 'hello', 'world', '"quoted words"', "'single quoted'", 'a"b', '\xa0', '　',
+             'http://example.com/page?q=1', '"', "'", 'x' * 40]
+    messages = []
+    for _ in range(count):
+        parts = [rng.choice(words) for _ in range(rng.randint(0, 60))]
+        text = '/' + rng.choice(['ping', 'think', '_url_handle', 'remind']) + ' ' + \
+               ''.join(part + rng.choice([' ', '  ', '\t', '\n', '']) for part in parts)
+        messages.append(text)
+    return messages
+
+
+def check_names():
+    """However the command character is spaced, the name that's checked and run is the same."""
+    for text in ['/ping', '/ ping', '/  ping now', '/\u3000ping', '/\tping', '/\nping', '/ /ping']:
+        assert parse_command(text).name == 'ping', repr(text)
+    assert parse_command('/bot  ping', '/bot ').name == 'ping'
+    assert parse_command('/ ', '/').name is None
+
+
+def timed(func, messages):
+    start = time.perf_counter()
+    for text in messages:
+        func(text)
+    return time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    check_names()
+    messages = make_messages(count)
+
+    parsable = []
+    for text in messages:
+        try:
+            expected = legacy_split(text)
+        except ValueError:  # Unclosed quote, which shlex refuses to split.
+            continue
+        assert list(parse_command(text).tokens) == expected, repr(text)
+        parsable.append(text)
+    print('{} of {} messages split identically (the rest have unclosed quotes)'.format(len(parsable), count))
+
+    legacy_time = timed(legacy_split, parsable)
+    uncached_time = timed(parse_command.__wrapped__, parsable)
+    parse_command.cache_clear()
+    repeated = parsable[:50] * (len(parsable) // 50)
+    repeated_legacy_time = timed(legacy_split, repeated)
+    repeated_time = timed(parse_command, repeated)
+    print('{} messages: legacy {:.3f}s, new {:.3f}s ({:.1f}x)'.format(
+        len(parsable), legacy_time, uncached_time, legacy_time / uncached_time))
+    print('{} messages, 50 distinct: legacy {:.3f}s, new (cached) {:.3f}s ({:.1f}x)'.format(
+        len(repeated), repeated_legacy_time, repeated_time, repeated_legacy_time / repeated_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Core.Util import Levenshtein
+
+''' Compares the Levenshtein engine against the full-matrix UtilBot.levenshtein_distance it replaced, on synthetic songs
+scored the way /finish does: one query against every line, keeping the closest. Checks that both pick the same line
+with the same distance, and that every line scores the same. Run from the repository root:
+python Benchmarks/bench_levenshtein.py [songs]'''
+
+WORDS = ['baby', 'love', 'night', 'heart', 'tonight', 'never', 'gonna', 'give', 'you', 'up', 'down', 'the', 'a', 'i',
+         'we', 'all', 'know', 'feel', 'it', 'in', 'my', 'soul', 'dancing', 'on', 'own', 'somebody', "don't", 'stop',
+         'believing', 'hold', 'on', 'to', 'that', 'feeling', 'oh', 'yeah', 'whoa', 'hey', 'again', 'forever']
+
+
+def legacy_levenshtein_distance(first, second):
+    chopped = False
+    if len(first) > len(second):
+        first = first[:len(second)]
+        first, second = second, first
+        chopped = True
+    if len(second) == 0:
+        return len(first)
+    first_length = len(first) + 1
+    second_length = len(second) + 1
+    distance_matrix = [[0] * second_length for x in range(first_length)]
+    for i in range(first_length):
+        distance_matrix[i][0] = i
+    for j in range(second_length):
+        distance_matrix[0][j] = j
+    for i in range(1, first_length):
+        for j in range(1, second_length):
+            deletion = distance_matrix[i - 1][j] + 1
+            insertion = distance_matrix[i][j - 1] + 1
+            substitution = distance_matrix[i - 1][j - 1]
+            if first[i - 1] != second[j - 1]:
+                substitution += 1
+            distance_matrix[i][j] = min(insertion, deletion, substitution)
+    return distance_matrix[first_length - 1][second_length - 1], chopped
+
+
+def legacy_best_match(query, lines):
+    best = None
+    for index, line in enumerate(lines):
+        distance, chopped = legacy_levenshtein_distance(line, query)
+        if best is None or distance < best[1]:
+            best = index, distance, chopped
+    return best
+
+
+def make_line(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def make_song(rng):
+    """About 60 lines in verses and a repeated chorus, with section headings and blank lines between them."""
+    chorus = [make_line(rng, rng.randint(4, 12)) for _ in range(4)]
+    lines = []
+    for verse in range(1, 5):
+        lines += ['[Verse {}]'.format(verse)] + [make_line(rng, rng.randint(4, 12)) for _ in range(8)] + ['']
+        lines += ['[Chorus]'] + chorus + ['']
+    return lines
+
+
+def make_query(rng, song):
+    """A line of the song with some typos, some of it cut off, or a few words of it, like people type them."""
+    line = rng.choice([line for line in song if line and not line.startswith('[')])
+    kind = rng.choice(['typos', 'start', 'words'])
+    if kind == 'start':
+        line = line[:rng.randint(len(line) // 3, len(line))]
+    elif kind == 'words':
+        words = line.split()
+        line = ' '.join(words[:rng.randint(1, len(words))])
+    chars = list(line.lower())
+    for _ in range(rng.randint(0, 3)):
+        if chars:
+            chars[rng.randrange(len(chars))] = rng.choice('abcdefghijklmnopqrstuvwxyz ')
+    return ''.join(chars)
+
+
+def timed(func, cases):
+    start = time.perf_counter()
+    results = [func(query, lines) for query, lines in cases]
+    return time.perf_counter() - start, results
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    rng = random.Random(0)
+    cases = []
+    for _ in range(count):
+        song = [line for line in make_song(rng)[:-1] if line.strip()]
+        cases.append((make_query(rng, song), song))
+    lines = sum(len(song) for _, song in cases)
+
+    for query, song in cases:
+        assert Levenshtein.score_all(query, song) == [legacy_levenshtein_distance(line, query) for line in song]
+
+    legacy_time, expected = timed(legacy_best_match, cases)
+    all_time, _ = timed(Levenshtein.score_all, cases)
+    best_time, results = timed(Levenshtein.best_match, cases)
+    assert results == expected
+    print('{} songs, {} lines, queries of {:.0f} characters on average'.format(
+        count, lines, sum(len(query) for query, _ in cases) / count))
+    print('  legacy matrix, every line     {:8.3f}s'.format(legacy_time))
+    print('  score_all, every line         {:8.3f}s ({:.1f}x)'.format(all_time, legacy_time / all_time))
+    print('  best_match, bounded           {:8.3f}s ({:.1f}x)'.format(best_time, legacy_time / best_time))
+
+    # Where the bit-parallel path stops paying off: one unbounded distance per pair, by query length.
+    print('Unbounded distance by query length (Myers is used up to {}):'.format(Levenshtein.MYERS_MAX_LENGTH))
+    for length in [16, 64, 256, 1024]:
+        pairs = [(make_line(rng, length)[:length], make_line(rng, length)[:length]) for _ in range(20)]
+        start = time.perf_counter()
+        for first, second in pairs:
+            Levenshtein._myers_distance(Levenshtein._pattern_masks(first), len(first), second, length)
+        myers_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for first, second in pairs:
+            Levenshtein._table_distance(first, second, length)
+        table_time = time.perf_counter() - start
+        print('  {:4} characters: Myers {:.4f}s, two-row table {:.4f}s'.format(length, myers_time, table_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+
+''' Measures what importing the bot costs: how long each heavy module takes to import on its own (each in a fresh
+interpreter, best of a few runs), and which of them importing Core.Handlers, and with it every command module, still
+pulls in. Run from the repository root: python Benchmarks/bench_startup.py [runs]'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Third party and library modules only some commands need, and the bot's own modules.
+MODULES = ['hangups', 'aiohttp', 'bs4', 'nltk', 'parsedatetime', 'dateutil.parser', 'Libraries.Genius',
+           'Libraries.cleverbot', 'Libraries.summarize', 'Core.Util.UtilBot', 'Core.Commands.DefaultCommands',
+           'Core.Commands.ExtraCommands', 'Core.Handlers']
+DEFERRED = ['bs4', 'nltk', 'parsedatetime', 'dateutil.parser', 'Libraries.Genius', 'Libraries.cleverbot',
+            'Libraries.summarize']
+
+_TIME_IMPORT = '''
+import sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+'''
+
+_LOADED_AFTER = '''
+import sys
+sys.path.insert(0, {root!r})
+import {module}
+print(' '.join(name for name in {names!r} if name in sys.modules))
+'''
+
+
+def run_python(code):
+    process = subprocess.Popen([sys.executable, '-c', code], cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               universal_newlines=True)
+    output, errors = process.communicate()
+    if process.returncode != 0:
+        return None, errors.strip().splitlines()[-1]
+    return output.strip(), None
+
+
+def import_time(module, runs):
+    best = None
+    for _ in range(runs):
+        output, error = run_python(_TIME_IMPORT.format(root=ROOT, module=module))
+        if error:
+            return None, error
+        best = float(output) if best is None else min(best, float(output))
+    return best, None
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print('Import time of each module in a fresh interpreter (best of {}):'.format(runs))
+    for module in MODULES:
+        seconds, error = import_time(module, runs)
+        if error:
+            print('  {:32} unavailable ({})'.format(module, error))
+        else:
+            print('  {:32} {:8.1f} ms'.format(module, seconds * 1000))
+
+    output, error = run_python(_LOADED_AFTER.format(root=ROOT, module='Core.Handlers', names=DEFERRED))
+    if error:
+        print('Could not import Core.Handlers: {}'.format(error))
+    else:
+        print('Deferred modules loaded by importing Core.Handlers: {}'.format(output or 'none'))
+
+
+if __name__ == '__main__':
+    main()
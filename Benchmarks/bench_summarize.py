@@ -0,0 +1,89 @@
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import nltk
+
+from Libraries.summarize import summarize
+
+''' Compares summarize_block's batched scoring against the original per-pair compute_score implementation on long,
+synthetic pages. Run from the repository root: python Benchmarks/bench_summarize.py [words_per_page]'''
+
+_legacy_stop_words = list(summarize.get_stop_words())
+
+
+def legacy_is_unimportant(word):
+    return word in ['.', '!', ',', ] or '\'' in word or word in _legacy_stop_words
+
+
+def legacy_only_important(sent):
+    return filter(lambda w: not legacy_is_unimportant(w), sent)
+
+
+def legacy_compare_sents(sent1, sent2):
+    if not len(sent1) or not len(sent2):
+        return 0
+    return len(set(legacy_only_important(sent1)) & set(legacy_only_important(sent2))) / ((len(sent1) + len(sent2)) / 2.0)
+
+
+def legacy_compare_sents_bounded(sent1, sent2):
+    cmpd = legacy_compare_sents(sent1, sent2)
+    if summarize.LOWER_BOUND < cmpd < summarize.UPPER_BOUND:
+        return cmpd
+    return 0
+
+
+def legacy_compute_score(sent, sents):
+    if not len(sent):
+        return 0
+    return sum(legacy_compare_sents_bounded(sent, sent1) for sent1 in sents) / float(len(sents))
+
+
+def legacy_summarize_block(block):
+    if not block:
+        return None
+    sents = nltk.sent_tokenize(block)
+    word_sents = list(map(nltk.word_tokenize, sents))
+    d = dict((legacy_compute_score(word_sent, word_sents), sent)
+             for sent, word_sent in zip(sents, word_sents))
+    return d[max(d.keys())]
+
+
+def make_page(words, sentences_per_block, seed=0):
+    rng = random.Random(seed)
+    vocabulary = ['word{}'.format(i) for i in range(2000)] + sorted(summarize.get_stop_words())
+    blocks = []
+    block = []
+    for _ in range(words // 15):
+        block.append(' '.join(rng.choice(vocabulary) for _ in range(15)).capitalize() + '.')
+        if len(block) == sentences_per_block:
+            blocks.append(' '.join(block))
+            block = []
+    if block:
+        blocks.append(' '.join(block))
+    return blocks
+
+
+def timed(func, blocks):
+    start = time.perf_counter()
+    results = [func(block) for block in blocks]
+    return time.perf_counter() - start, results
+
+
+def main():
+    words = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print('numpy: {}'.format('yes' if summarize.numpy is not None else 'no'))
+    for sentences_per_block in (5, 20, 100, words // 15):
+        blocks = make_page(words, sentences_per_block)
+        legacy_time, legacy_results = timed(legacy_summarize_block, blocks)
+        new_time, new_results = timed(summarize.summarize_block, blocks)
+        assert legacy_results == new_results, 'summaries differ'
+        print('{} words, {} sentences/block: legacy {:.3f}s, new {:.3f}s ({:.1f}x)'.format(
+            words, sentences_per_block, legacy_time, new_time, legacy_time / new_time))
+
+
+if __name__ == '__main__':
+    main()
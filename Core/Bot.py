@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 # coding=utf-8
-from datetime import date, datetime
+from datetime import datetime
 import os
 import random
 import sys
@@ -8,16 +8,22 @@ import asyncio
 import tempfile
 import time
 import signal
+import threading
 import traceback
 from urllib import request
 from urllib.request import FancyURLopener
 
 import hangups
 from hangups.ui.utils import get_conv_name
-from requests import HTTPError
 from Core.Commands.Dispatcher import DispatcherSingleton
 
-from Core.Util import ConfigDict, UtilDB
+from Core.Util import ConfigDict, UtilDB, AsyncDB, UtilHTTP, UtilRecords
+from Core.Util.ConfigResolver import ConfigResolver
+from Core.Util.ConfigWatcher import ConfigWatcher
+from Core.Util.InboundQueue import InboundQueue
+from Core.Util.OutboundQueue import OutboundQueue
+from Core.Util.UserIndex import UserIndex
+from Core.Util.LinkPreview import LinkPreviewSingleton
 from Core import Handlers
 
 
@@ -29,6 +35,8 @@ request.urlretrieve = HangoutsBotOpener().retrieve
 
 __version__ = '1.1'
 LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+CONFIG_SAVE_DELAY = 2  # Seconds config changes are collected for before being written out together.
+INBOUND_WORKERS = 8  # Default number of chat messages handled at once (overridden by the inbound_workers option).
 
 
 class ConversationEvent(object):
@@ -64,13 +72,25 @@ class HangoutsBot(object):
         self._conv_list = None  # hangups.ConversationList
         self._user_list = None  # hangups.UserList
         self._message_handler = None  # MessageHandler
+        self._user_indexes = {}  # conv_id -> UserIndex, dropped when its members change.
+        self._loop = asyncio.get_event_loop()
+        self._loop_thread = threading.current_thread()
+        self.outbound = OutboundQueue()
 
         # Load config file
-        self.config = ConfigDict.ConfigDict(config_path)
+        self.config = ConfigDict.ConfigDict(config_path, save_delay=CONFIG_SAVE_DELAY)
+        self.config_resolver = ConfigResolver(self.config)
+        # Picks up edits to the config file while running.
+        self.config_watcher = ConfigWatcher(self.config, asyncio.get_event_loop())
+        self.config_watcher.start()
         self.devmode = self.get_config_suboption('', 'development_mode')
+        self.inbound = InboundQueue(self._handle_queued_message,
+                                    workers=self.get_config_suboption('', 'inbound_workers') or INBOUND_WORKERS)
 
         self.database = "database.db"
         UtilDB.setDatabase(self.database)
+        UtilRecords.init_tables()
+        UtilRecords.import_records()
 
         # Handle signals on Unix
         # (add_signal_handler is not implemented on Windows)
@@ -111,6 +131,12 @@ class HangoutsBot(object):
                     # If we are forcefully disconnected, try connecting again
                     loop = asyncio.get_event_loop()
                     loop.run_until_complete(self._client.connect())
+                    self.inbound.stop()
+                    self.config_watcher.stop()
+                    self.config.flush()
+                    AsyncDB.shutdown()
+                    UtilHTTP.close()
+                    LinkPreviewSingleton.shutdown()
                     sys.exit(0)
                 except Exception as e:
                     print('Client unexpectedly disconnected:\n{}'.format(e))
@@ -120,6 +146,7 @@ class HangoutsBot(object):
                     print(traceback.format_exc())
                     time.sleep(10)
             print('Maximum number of retries reached! Exiting...')
+        self.config.flush()
         sys.exit(1)
 
     def stop(self):
@@ -131,7 +158,13 @@ class HangoutsBot(object):
     def handle_chat_message(self, conv_event):
         """Handle chat messages"""
         event = ConversationEvent(self, conv_event)
-        asyncio.async(self._message_handler.handle(event))
+        # Under load, plain chat gives way to commands.
+        is_command = event.text.startswith(self._command_char)
+        if not self.inbound.put(event.conv_id, event, sheddable=not is_command):
+            print('Inbound queue full, dropped message from {}'.format(event.conv_id))
+
+    def _handle_queued_message(self, event, shed):
+        return self._message_handler.handle(event, shed_autoreplies=shed)
 
     def handle_membership_change(self, conv_event):
         """Handle conversation membership change"""
@@ -179,52 +212,44 @@ class HangoutsBot(object):
             return
 
         # TODO This needs to refactored. No extra-command specific logic should be in the Bot file.
-        if DispatcherSingleton.commands['record']:
+        if DispatcherSingleton.commands.get('record'):
             if event.conv_event.new_name == '':
                 text = "Name cleared"
-                directory = "Records" + os.sep + str(event.conv_id)
-                if not os.path.exists(directory):
-                    os.makedirs(directory)
-                filename = str(date.today()) + ".txt"
-                file = open(directory + os.sep + filename, "a+")
-                file.write(text + '\n')
             else:
                 text = "Name changed to: " + conv_event.new_name
-                directory = "Records" + os.sep + str(event.conv_id)
-                if not os.path.exists(directory):
-                    os.makedirs(directory)
-                filename = str(date.today()) + ".txt"
-                file = open(directory + os.sep + filename, "a+")
-                file.write(text + '\n')
+            asyncio.async(AsyncDB.run(UtilRecords.add_record, event.conv_id, text, event.user_id.chat_id))
+
+    def get_user_index(self, conversation):
+        """Returns a UserIndex of the conversation's users, for looking them up by name."""
+        try:
+            return self._user_indexes[conversation.id_]
+        except KeyError:
+            index = self._user_indexes[conversation.id_] = UserIndex(conversation.users)
+            return index
 
     def send_message(self, conversation, text):
         """"Send simple chat message"""
-        self.send_message_segments(conversation, [hangups.ChatMessageSegment(text)])
+        return self.send_message_segments(conversation, [hangups.ChatMessageSegment(text)])
 
     def send_message_segments(self, conversation, segments, image_id=None):
         """Send chat message segments"""
         # Ignore if the user hasn't typed a message.
         if len(segments) == 0:
             return
-        # XXX: Exception handling here is still a bit broken. Uncaught
-        # exceptions in _on_message_sent will only be logged.
-        asyncio.async(
-            conversation.send_message(segments, image_id=image_id)
-        ).add_done_callback(self._on_message_sent)
+        # Blocking commands run on the dispatcher's thread pool, so hand their messages over to the event loop.
+        if threading.current_thread() is not self._loop_thread:
+            self._loop.call_soon_threadsafe(self.send_message_segments, conversation, segments, image_id)
+            return
+        return self.outbound.send(conversation, segments, image_id=image_id)
 
     @asyncio.coroutine
     def upload_image(self, url, filename=None, delete=False):
         if not filename:
             tempdir = tempfile.gettempdir()
             filename = tempdir + os.sep + '{}.png'.format(random.randint(0, 9999999999))
-        req = request.Request(url, headers={
-            'User-agent': 'Mozilla/5.0 (Windows NT 6.3; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/37.0.2049.0 Safari/537.36'})
-        image = request.urlopen(req)
-        try:
-            with open(filename, "wb") as image_file:
-                image_file.write(image.read())
-        except HTTPError as e:
-            raise e
+        image = yield from UtilHTTP.fetch(url)
+        with open(filename, "wb") as image_file:
+            image_file.write(image.body)
 
         # request.urlretrieve(url, filename)
         file = open(filename, "rb")
@@ -242,27 +267,20 @@ class HangoutsBot(object):
 
     def get_config_suboption(self, conv_id, option):
         """Get config suboption for conversation (or global option if not defined)"""
-        try:
-            suboption = self.config['conversations'][conv_id][option]
-        except KeyError:
-            try:
-                suboption = self.config[option]
-            except KeyError:
-                suboption = None
-        except TypeError:
-            if self.config['conversations'] is None:
-                self.config['conversations'] = {}
-            elif self.config['conversations'][conv_id] is None:
-                self.config['conversations'][conv_id] = {}
-            suboption = None
-        return suboption
-
-    def _on_message_sent(self, future):
-        """Handle showing an error if a message fails to send"""
-        try:
-            future.result()
-        except hangups.NetworkError:
-            print('Failed to send message!')
+        return self.config_resolver.get_option(conv_id, option)
+
+    def get_conv_config(self, conv_id):
+        """Get the read-only view of every option for conversation, merged over the global options"""
+        return self.config_resolver.get(conv_id)
+
+    def set_config_suboption(self, conv_id, option, value):
+        """Set config suboption for conversation, creating the conversation's section if needed"""
+        if not isinstance(self.config['conversations'], dict):
+            self.config['conversations'] = {}
+        if isinstance(self.config['conversations'].get(conv_id), dict):
+            self.config.set_by_path(['conversations', conv_id, option], value)
+        else:
+            self.config.set_by_path(['conversations', conv_id], {option: value})
 
     def _on_connect(self, initial_data):
         """Handle connecting for the first time"""
@@ -277,6 +295,7 @@ class HangoutsBot(object):
                                                    self._user_list,
                                                    initial_data.sync_timestamp)
         self._conv_list.on_event.add_observer(self._on_event)
+        self._user_indexes.clear()
 
         self._message_handler = Handlers.MessageHandler(self, command_char=self._command_char)
 
@@ -290,6 +309,7 @@ class HangoutsBot(object):
         if isinstance(conv_event, hangups.ChatMessageEvent):
             self.handle_chat_message(conv_event)
         elif isinstance(conv_event, hangups.MembershipChangeEvent):
+            self._user_indexes.pop(conv_event.conversation_id, None)
             self.handle_membership_change(conv_event)
         elif isinstance(conv_event, hangups.RenameEvent):
             self.handle_rename(conv_event)
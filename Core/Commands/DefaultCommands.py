@@ -1,65 +1,94 @@
 import asyncio
 import json
 from urllib import parse
-from urllib import request
 import re
 from urllib.error import HTTPError, URLError
 
-from bs4 import BeautifulSoup
 import hangups
 from hangups import schemas
 from hangups.ui.utils import get_conv_name
-nltk_installed = True
-try:
-    from Libraries import summarize
-except ImportError:
-    nltk_installed = False
-
-from Libraries.cleverbot import ChatterBotFactory, ChatterBotType
 from Core.Commands.Dispatcher import DispatcherSingleton
-from Core.Util import UtilBot
+from Core.Util import UtilBot, AsyncDB, UtilHTTP, NLTKData
+from Core.Util.LazyImport import lazy_import
+from Core.Util.ResultCache import CommandCache
+from Core.Util.LinkPreview import LinkPreviewSingleton, PreviewUnavailableError
+
+# Imported when first used. (Link previews import the summarizer through LinkPreview.)
+cleverbot = lazy_import('Libraries.cleverbot')
+nltk_installed = NLTKData.is_ready()
 
-clever_session = ChatterBotFactory().create(ChatterBotType.CLEVERBOT).create_session()
+clever_session = None  # Created by get_clever_session the first time /think is used.
 last_recorded, last_recorder = None, None
+_help_texts = {}  # Tuple of commands a user can see -> /help text listing them.
 
 
 
 
 @DispatcherSingleton.register_unknown
-def unknown_command(bot, event, *args):
-    bot.send_message(event.conv,
-                     '{}: Unknown command!'.format(event.user.full_name))
+def unknown_command(bot, event, command=None, *args):
+    suggestions = DispatcherSingleton.index.suggest(command, event.conv_id, bot.get_conv_config(event.conv_id),
+                                                    event.user_id[0])
+    if suggestions:
+        bot.send_message(event.conv, '{}: Unknown command! Did you mean {}?'.format(event.user.full_name,
+                                                                                     ' or '.join(suggestions)))
+    else:
+        bot.send_message(event.conv, '{}: Unknown command!'.format(event.user.full_name))
+
+
+def get_clever_session():
+    global clever_session
+    if clever_session is None:
+        clever_session = cleverbot.ChatterBotFactory().create(cleverbot.ChatterBotType.CLEVERBOT).create_session()
+    return clever_session
 
 
 @DispatcherSingleton.register_hidden
 def think(bot, event, *args):
+    clever_session = get_clever_session()
     if clever_session:
-        bot.send_message(event.conv, clever_session.think(' '.join(args)))
+        thought = cleverbot.ChatterBotThought()
+        thought.text = ' '.join(args)
+        data = clever_session.prepare_thought(thought)
+        try:
+            home = yield from UtilHTTP.fetch(clever_session.home_url)
+            response = yield from UtilHTTP.fetch(clever_session.bot.url, method='POST', data=data,
+                                                 cookies=home.cookies)
+        except (HTTPError, URLError):
+            return
+        bot.send_message(event.conv, clever_session.process_response(response.body).text)
 
 
 @DispatcherSingleton.register
 def help(bot, event, command=None, *args):
-    valid_user_commands = []
-    for command_test in sorted(DispatcherSingleton.commands.keys()):
-        if UtilBot.check_if_can_run_command(bot, event, command_test):
-            valid_user_commands.append(command_test)
-    docstring = """
+    if command == '?' or command is None:
+        valid_user_commands = DispatcherSingleton.index.visible(event.conv_id, bot.get_conv_config(event.conv_id),
+                                                                event.user_id[0])
+        try:
+            docstring = _help_texts[valid_user_commands]
+        except KeyError:
+            docstring = _help_texts[valid_user_commands] = """
     **Current Implemented Commands:**
     {}
     Use: /<command name> ? or /help <command name> to find more information about the command.
     """.format(', '.join(valid_user_commands))
-    if command == '?' or command is None:
         bot.send_message_segments(event.conv, UtilBot.text_to_segments(docstring))
     else:
         if command in DispatcherSingleton.commands.keys():
             func = DispatcherSingleton.commands[command]
             if func.__doc__:
-                bot.send_message_segments(event.conv, UtilBot.text_to_segments(func.__doc__))
+                text = func.__doc__
+                aliases = DispatcherSingleton.index.aliases(func.__name__)
+                if aliases:
+                    text = '{}\nAliases: {}\n'.format(text.rstrip(), ', '.join(aliases))
+                bot.send_message_segments(event.conv, UtilBot.text_to_segments(text))
             else:  # Compatibility purposes for the old way of showing help text.
                 args = ['?']
                 func(bot, event, *args)
         else:
-            bot.send_message("The command {} is not registered.".format(command))
+            suggestions = DispatcherSingleton.index.suggest(command, event.conv_id,
+                                                            bot.get_conv_config(event.conv_id), event.user_id[0])
+            bot.send_message(event.conv, "The command {} is not registered.{}".format(
+                command, ' Did you mean {}?'.format(' or '.join(suggestions)) if suggestions else ''))
 
 
 @DispatcherSingleton.register
@@ -71,7 +100,9 @@ def define(bot, event, *args):
     Purpose: Show definitions for a word.
     """
     if args[-1].isdigit():
-        definition, length = UtilBot.define(' '.join(args[0:-1]), num=int(args[-1]))
+        query = ' '.join(args[0:-1])
+        definitions = yield from CommandCache.get_or_fetch('define', [query], lambda: UtilBot.get_definitions(query))
+        definition, length = UtilBot.format_definition(definitions, num=int(args[-1]))
         segments = [hangups.ChatMessageSegment(' '.join(args[0:-1]).title(), is_bold=True),
                     hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK),
                     hangups.ChatMessageSegment(
@@ -108,9 +139,11 @@ def define(bot, event, *args):
         definition_segments = [hangups.ChatMessageSegment(query.title(), is_bold=True),
                                hangups.ChatMessageSegment('', segment_type=hangups.SegmentType.LINE_BREAK)]
         if start < end:
+            definitions = yield from CommandCache.get_or_fetch('define', [query],
+                                                               lambda: UtilBot.get_definitions(query))
             x = start
             while x <= end:
-                definition, length = UtilBot.define(query, num=x)
+                definition, length = UtilBot.format_definition(definitions, num=x)
                 definition_segments.append(hangups.ChatMessageSegment(definition))
                 if x != end:
                     definition_segments.append(
@@ -128,7 +161,7 @@ def define(bot, event, *args):
     else:
         args = list(args)
         args.append("1:3")
-        define(bot, event, *args)
+        yield from define(bot, event, *args)
         return
 
 
@@ -160,19 +193,31 @@ def wiki(bot, event, *args):
         return self._summary
 
     wikipedia.WikipediaPage.summary = summary
-    try:
-        sentences = 3
+
+    def lookup_sync(query, sentences):
         try:
-            if args[-1].isdigit():
-                sentences = args[-1]
-                args = args[:-1]
-            page = wikipedia.page(' '.join(args))
+            page = wikipedia.page(query)
         except DisambiguationError as e:
             page = wikipedia.page(wikipedia.search(e.options[0], results=1)[0])
+        return [page.title, page.url, page.summary(sentences=sentences)]
+
+    @asyncio.coroutine
+    def lookup(query, sentences):
+        # The wikipedia library makes blocking requests, so keep them off the event loop.
+        return (yield from asyncio.get_event_loop().run_in_executor(None, lookup_sync, query, sentences))
+
+    try:
+        sentences = 3
+        if args[-1].isdigit():
+            sentences = args[-1]
+            args = args[:-1]
+        query = ' '.join(args)
+        title, url, text = yield from CommandCache.get_or_fetch('wiki', [query, sentences],
+                                                                lambda: lookup(query, sentences))
         segments = [
-            hangups.ChatMessageSegment(page.title, hangups.SegmentType.LINK, is_bold=True, link_target=page.url),
+            hangups.ChatMessageSegment(title, hangups.SegmentType.LINK, is_bold=True, link_target=url),
             hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK),
-            hangups.ChatMessageSegment(page.summary(sentences=sentences))]
+            hangups.ChatMessageSegment(text)]
 
         bot.send_message_segments(event.conv, segments)
     except PageError:
@@ -200,11 +245,19 @@ def goog(bot, event, *args):
         'User-agent': 'Mozilla/5.0 (Windows NT 6.3; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/37.0.2049.0 Safari/537.36'}
 
     @asyncio.coroutine
-    def send_goog_message(bot, event, url, query=None, headers=None):
-        req = request.Request(url, None, headers)
+    def get_title(url, headers=None):
         try:
-            resp = request.urlopen(req, timeout=10)
-        except HTTPError:
+            soup = yield from UtilHTTP.fetch_soup(url, headers=headers, timeout=10)
+        except (HTTPError, URLError):
+            return None
+        # A plain str, so the cache doesn't keep the whole parsed page alive through the title.
+        title = str(soup.title.string or '') if soup.title else ''
+        return title.strip() or None
+
+    @asyncio.coroutine
+    def send_goog_message(bot, event, url, query=None, headers=None):
+        title = yield from CommandCache.get_or_fetch('goog', [query], lambda: get_title(url, headers))
+        if not title:
             segments = [hangups.ChatMessageSegment('Result:', is_bold=True),
                         hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK)]
             if query:
@@ -212,10 +265,9 @@ def goog(bot, event, *args):
 
             bot.send_message_segments(event.conv, segments)
             return
-        soup = BeautifulSoup(resp)
         bot.send_message_segments(event.conv, [hangups.ChatMessageSegment('Result:', is_bold=True),
                                                hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK),
-                                               hangups.ChatMessageSegment(soup.title.string, hangups.SegmentType.LINK,
+                                               hangups.ChatMessageSegment(title, hangups.SegmentType.LINK,
                                                                           link_target=url)])
 
     yield from send_goog_message(bot, event, url, search_terms, headers)
@@ -251,7 +303,7 @@ def users(bot, event, *args):
     segments = [hangups.ChatMessageSegment('Users: '.format(len(event.conv.users)),
                                            is_bold=True),
                 hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK)]
-    for user in sorted(event.conv.users, key=lambda x: x.full_name.split()[-1]):
+    for user in bot.get_user_index(event.conv).users:
         link = 'https://plus.google.com/u/0/{}/about'.format(user.id_.chat_id)
         segments.append(hangups.ChatMessageSegment(user.full_name, hangups.SegmentType.LINK,
                                                    link_target=link))
@@ -272,14 +324,10 @@ def user(bot, event, username, *args):
     Usage: /user <user name>
     Purpose: Lists information about the specified user in the current chat.
     """
-    username_lower = username.strip().lower()
     segments = [hangups.ChatMessageSegment('User: "{}":'.format(username),
                                            is_bold=True),
                 hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK)]
-    for u in sorted(event.conv.users, key=lambda x: x.full_name.split()[-1]):
-        if username_lower not in u.full_name.lower():
-            continue
-
+    for u in bot.get_user_index(event.conv).find(username):
         link = 'https://plus.google.com/u/0/{}/about'.format(u.id_.chat_id)
         segments.append(hangups.ChatMessageSegment(u.full_name, hangups.SegmentType.LINK,
                                                    link_target=link))
@@ -306,13 +354,11 @@ def hangouts(bot, event, *args):
     segments = [hangups.ChatMessageSegment('Currently In These Hangouts:', is_bold=True),
                 hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK)]
     for c in bot.list_conversations():
+        conv_config = bot.get_conv_config(c.id_)
         s = '{} [commands: {:d}, forwarding: {:d}, autoreplies: {:d}]'.format(get_conv_name(c, truncate=True),
-                                                                              bot.get_config_suboption(c.id_,
-                                                                                                       'commands_enabled'),
-                                                                              bot.get_config_suboption(c.id_,
-                                                                                                       'forwarding_enabled'),
-                                                                              bot.get_config_suboption(c.id_,
-                                                                                                       'autoreplies_enabled'))
+                                                                              conv_config.get('commands_enabled'),
+                                                                              conv_config.get('forwarding_enabled'),
+                                                                              conv_config.get('autoreplies_enabled'))
         segments.append(hangups.ChatMessageSegment(s))
         segments.append(hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK))
 
@@ -385,11 +431,7 @@ def mute(bot, event, *args):
     Usage: /mute
     Purposes: Mutes all autoreplies.
     """
-    try:
-        bot.config['conversations'][event.conv_id]['autoreplies_enabled'] = False
-    except KeyError:
-        bot.config['conversation'][event.conv_id] = {}
-        bot.config['conversation'][event.conv_id]['autoreplies_enabled'] = False
+    bot.set_config_suboption(event.conv_id, 'autoreplies_enabled', False)
     bot.config.save()
 
 
@@ -408,11 +450,7 @@ def unmute(bot, event, *args):
                     hangups.ChatMessageSegment('Purpose: Unmutes all non-command replies.')]
         bot.send_message_segments(event.conv, segments)
     else:
-        try:
-            bot.config['conversations'][event.conv_id]['autoreplies_enabled'] = True
-        except KeyError:
-            bot.config['conversations'][event.conv_id] = {}
-            bot.config['conversations'][event.conv_id]['autoreplies_enabled'] = True
+        bot.set_config_suboption(event.conv_id, 'autoreplies_enabled', True)
         bot.config.save()
 
 
@@ -424,11 +462,21 @@ def status(bot, event, *args):
     Purpose: Shows current bot status.
     """
 
+    cache_stats = CommandCache.stats()
+    inbound_stats = bot.inbound.stats()
     segments = [hangups.ChatMessageSegment('Status:', is_bold=True),
                 hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK),
                 hangups.ChatMessageSegment(
-                    'Autoreplies: ' + ('Enabled' if bot.config['conversations'][event.conv_id][
-                        'autoreplies_enabled'] else 'Disabled'))]
+                    'Autoreplies: ' + ('Enabled' if bot.get_config_suboption(event.conv_id, 'autoreplies_enabled')
+                                       else 'Disabled')),
+                hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK),
+                hangups.ChatMessageSegment('Lookup cache: {} entries, {} hits, {} misses'.format(
+                    cache_stats['entries'], cache_stats['hits'], cache_stats['misses'])),
+                hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK),
+                hangups.ChatMessageSegment('Message queue: {} waiting (peak {}), {:.0f}ms average wait, {} shed, {} dropped'
+                                           .format(inbound_stats['depth'], inbound_stats['max_depth'],
+                                                   inbound_stats['average_wait'] * 1000, inbound_stats['shed'],
+                                                   inbound_stats['dropped']))]
     bot.send_message_segments(event.conv, segments)
 
 
@@ -447,6 +495,8 @@ def reload(bot, event, *args):
                     hangups.ChatMessageSegment('Purpose: Reloads current config file.')]
         bot.send_message_segments(event.conv, segments)
     else:
+        # Write out unsaved changes first so they aren't lost, without holding up the event loop.
+        yield from bot.config.flush_async()
         bot.config.load()
 
 
@@ -474,10 +524,10 @@ def config(bot, event, cmd=None, *args):
             bot.config.save()
             value = bot.config.get_by_path(config_args)
         else:
-            yield from DispatcherSingleton.unknown_command(bot, event)
+            yield from asyncio.coroutine(DispatcherSingleton.unknown_command)(bot, event)
             return
     else:
-        yield from DispatcherSingleton.unknown_command(bot, event)
+        yield from asyncio.coroutine(DispatcherSingleton.unknown_command)(bot, event)
         return
 
     if value is None:
@@ -506,9 +556,8 @@ def block(bot, event, username=None, *args):
             segments.pop()
         bot.send_message_segments(event.conv, segments)
         return
-    username_lower = username.strip().lower()
-    for u in sorted(event.conv.users, key=lambda x: x.full_name.split()[-1]):
-        if not username_lower in u.full_name.lower() or event.user.is_self:
+    for u in bot.get_user_index(event.conv).find(username):
+        if event.user.is_self:
             continue
 
         if u.id_ == event.user.id_:
@@ -581,11 +630,7 @@ def vote(bot, event, set_vote=None, *args):
 
             def set_conv_admin(won):
                 if won:
-                    try:
-                        bot.config["conversations"][event.conv_id]["conversation_admin"] = event.user.id_[0]
-                    except (KeyError, TypeError):
-                        bot.config["conversations"][event.conv_id] = {}
-                        bot.config["conversations"][event.conv_id]["admin"] = event.user.id_[0]
+                    bot.set_config_suboption(event.conv_id, 'conversation_admin', event.user.id_[0])
                     bot.config.save()
 
             vote_callback = set_conv_admin
@@ -649,19 +694,16 @@ def _karma(bot, event, *args):
         sub = 6
     username = username.replace("+", "")
     username = username.replace("-", "")
-    username = username.lower()
-    for u in sorted(event.conv.users, key=lambda x: x.full_name.split()[-1]):
-        if username not in u.full_name.lower():
-            continue
+    for u in bot.get_user_index(event.conv).find(username):
         if u.id_ == event.user.id_:
             bot.send_message(event.conv, "Your Karma changes with actions upon others, not actions upon oneself.")
             return
 
         new_karma = None
         if add >= 2 and sub == 0:
-            new_karma = UtilBot.change_karma(u.id_[0], add - 1)
+            new_karma = yield from AsyncDB.change_karma(u.id_[0], add - 1)
         elif sub >= 2 and add == 0:
-            new_karma = UtilBot.change_karma(u.id_[0], (sub - 1) * -1)
+            new_karma = yield from AsyncDB.change_karma(u.id_[0], (sub - 1) * -1)
         if new_karma is not None:
             bot.send_message(event.conv, "{}'s karma is now {}".format(u.full_name, new_karma))
             return
@@ -674,23 +716,20 @@ def karma(bot, event, name=None, *args):
     if name:
         if name[0] == '@':
             name = name[1:]
-        lower_name = name.lower()
-        for u in sorted(event.conv.users, key=lambda x: x.full_name.split()[-1]):
-            if lower_name not in u.full_name.lower():
-                continue
-
+        u = bot.get_user_index(event.conv).find_one(name)
+        if u is not None:
+            current_karma = yield from AsyncDB.get_current_karma(u.id_[0])
             segments = [hangups.ChatMessageSegment('%s:' % u.full_name, is_bold=True),
                         hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK),
-                        hangups.ChatMessageSegment('Karma: ' + str(UtilBot.get_current_karma(u.id_[0])))]
+                        hangups.ChatMessageSegment('Karma: ' + str(current_karma))]
             bot.send_message_segments(event.conv, segments)
             return
         bot.send_message(event.conv, 'No user found matching "%s".' % name)
 
     else:
-        karma_list = []
         list_num = min(5, int(len(event.conv.users) / 2) + 1)
-        for u in event.conv.users:
-            karma_list.append((u.full_name, UtilBot.get_current_karma(u.id_[0])))
+        karma_by_user = yield from AsyncDB.get_karma_for_users(u.id_[0] for u in event.conv.users)
+        karma_list = [(u.full_name, karma_by_user[u.id_[0]]) for u in event.conv.users]
         karma_list.sort(key=lambda x: -x[1])
         segments = [hangups.ChatMessageSegment("Karma Stats:", is_bold=True),
                     hangups.ChatMessageSegment("\n", segment_type=hangups.SegmentType.LINE_BREAK),
@@ -726,8 +765,7 @@ def image(bot, event, *args):
     url = 'http://ajax.googleapis.com/ajax/services/search/images?v=1.0&rsz=8&safe=active&imgsz=medium&' \
           + parse.urlencode({'q': query})
 
-    resp = request.urlopen(url)
-    image_json = json.loads(resp.read().decode())
+    image_json = yield from UtilHTTP.fetch_json(url)
     url = image_json['responseData']['results'][0]['unescapedUrl']
 
     yield from send_image(bot, event, url)
@@ -738,8 +776,7 @@ def gif(bot, event, *args):
     query = ' '.join(args)
     url = 'http://ajax.googleapis.com/ajax/services/search/images?v=1.0&rsz=8&safe=active&imgsz=medium&imgtype=animated&' \
           + parse.urlencode({'q': query})
-    resp = request.urlopen(url)
-    image_json = json.loads(resp.read().decode())
+    image_json = yield from UtilHTTP.fetch_json(url)
     url = image_json['responseData']['results'][0]['unescapedUrl']
 
     yield from send_image(bot, event, url)
@@ -749,7 +786,7 @@ def gif(bot, event, *args):
 def send_image(bot, event, url):
     try:
         image_id = yield from bot.upload_image(url)
-    except HTTPError:
+    except (HTTPError, URLError):
         bot.send_message(event.conv, "Error attempting to upload image.")
         return
     bot.send_message_segments(event.conv, [
@@ -777,7 +814,7 @@ def _url_handle(bot, event, url):
             url = "http://" + url
 
         try:
-            summary = summarize.summarize_page(url)
+            summary = yield from LinkPreviewSingleton.get_summary(url)
             if len(summary.summaries) < 3:
                 return
             if len(summary.summaries) > 3:
@@ -788,7 +825,7 @@ def _url_handle(bot, event, url):
             segments = [hangups.ChatMessageSegment('"{}" gave HTTP error code {}.'.format(url, e.code))]
             bot.send_message_segments(event.conv, segments)
             return
-        except (ValueError, URLError):
+        except (ValueError, URLError, PreviewUnavailableError):
             yield from bot._client.settyping(event.conv_id, hangups.TypingStatus.STOPPED)
             return
 
@@ -1,6 +1,10 @@
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import functools
+import inspect
 from Core.Util import UtilBot
+from Core.Util.CommandIndex import CommandIndex
 import traceback
 
 ''' To use this, either add on to the ExtraCommands.py file or create your own Python file. Import the DispatcherSingleton
@@ -12,7 +16,22 @@ appear in the /help menu. It should be noted that hidden commands' primary purpo
 won't be able to be ran by anyone other than the Bot itself.
 
 To choose what happens when a command isn't found, register a function with @DispatcherSingleton.register_unknown, and
-that function will run whenever the Bot can't find a command that suits what the user entered.'''
+that function will run whenever the Bot can't find a command that suits what the user entered. It's given what the user
+entered as its first argument; DispatcherSingleton.index.suggest can find what they probably meant.
+
+Commands run on the event loop, so they can use the bot's state (config, votes, the conversation list...) freely, and
+should use yield from for anything slow. A plain function that only does blocking work (network, disk, number
+crunching) without touching the bot's state can be registered with blocking=True, e.g.
+@DispatcherSingleton.register(blocking=True), to run it on a small thread pool instead; bot.send_message is safe to
+call from there. A blocking command that runs longer than its timeout (BLOCKING_COMMAND_TIMEOUT, or timeout=... when
+registering) is given up on.'''
+
+
+# Commands allowed to run at once. Further commands wait for a slot, which in turn holds up the inbound queue instead of
+# piling up tasks.
+MAX_RUNNING_COMMANDS = 16
+BLOCKING_COMMAND_WORKERS = 4
+BLOCKING_COMMAND_TIMEOUT = 30
 
 
 class NoCommandFoundError(Exception):
@@ -23,20 +42,18 @@ class CommandDispatcher(object):
     def __init__(self):
         self.commands = {}
         self.hidden_commands = {}
+        self.index = CommandIndex()  # Of self.commands, for /help and suggestions.
         self.unknown_command = None
         self.on_connect_listeners = []
+        self._command_slots = None
+        self._executor = None
+        self._blocking = {}  # Command function -> whether it runs on the thread pool.
+        self._timeouts = {}  # Command function -> timeout in seconds, for blocking commands.
 
     @asyncio.coroutine
-    def run(self, bot, event, bot_command_char, *args, **kwds):
-
-        bot_command_char = bot_command_char.strip()  # For cases like "/bot " or " / "
-
-        if args[0] == bot_command_char:  # Either the command char is like "/bot" or the user did "/ ping"
-            args = list(args[1:])
-        if args[0].startswith(bot_command_char):
-            command = args[0][len(bot_command_char):]
-        else:
-            command = args[0]
+    def run(self, bot, event, command, *args, **kwds):
+        """Runs command (its name, without the command character, as parsed by CommandParser.parse_command)."""
+        args = list(args)
         try:
             func = self.commands[command]
         except KeyError:
@@ -48,76 +65,136 @@ class CommandDispatcher(object):
             except KeyError:
                 if self.unknown_command:
                     func = self.unknown_command
+                    args.insert(0, command)
                 else:
                     raise NoCommandFoundError(
                         "Command {} is not registered. Furthermore, no command found to handle unknown commands.".format
                         (command))
 
-        func = asyncio.coroutine(func)
-
-        args = list(args[1:])
-
         # For help cases.
         if len(args) > 0 and args[0] == '?':
             if func.__doc__:
                 bot.send_message_segments(event.conv, UtilBot.text_to_segments(func.__doc__))
                 return
 
+        if self._command_slots is None:
+            self._command_slots = asyncio.Semaphore(MAX_RUNNING_COMMANDS)
+        yield from self._command_slots.acquire()
         try:
-            asyncio.async(func(bot, event, *args, **kwds))
+            if self.is_blocking(func):
+                task = asyncio.async(self._run_blocking(func, bot, event, args, kwds))
+            else:
+                task = asyncio.async(asyncio.coroutine(func)(bot, event, *args, **kwds))
         except Exception as e:
-            log = open('log.txt', 'a+')
-            log.writelines(str(datetime.now()) + ":\n " + traceback.format_exc() + "\n\n")
-            log.close()
-            print(traceback.format_exc())
+            self._command_slots.release()
+            self._log_exception(traceback.format_exc())
+        else:
+            task.add_done_callback(self._on_command_done)
+
+    def is_blocking(self, func):
+        return self._blocking.get(func, False)
 
-    def register_aliases(self, aliases=None):
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(BLOCKING_COMMAND_WORKERS)
+        return self._executor
+
+    @asyncio.coroutine
+    def _run_blocking(self, func, bot, event, args, kwds):
+        timeout = self._timeouts.get(func, BLOCKING_COMMAND_TIMEOUT)
+        future = asyncio.get_event_loop().run_in_executor(self._get_executor(),
+                                                          functools.partial(func, bot, event, *args, **kwds))
+        try:
+            return (yield from asyncio.wait_for(future, timeout))
+        except asyncio.TimeoutError:
+            # A command that hasn't started yet is cancelled; one that's already running can't be interrupted, but
+            # nothing waits for it any more.
+            self._log_exception('Command {} timed out after {} seconds.'.format(func.__name__, timeout))
+
+    def _set_mode(self, func, blocking=False, timeout=None):
+        if blocking and inspect.isgeneratorfunction(func):
+            raise ValueError('{} is a coroutine, so it already runs on the event loop.'.format(func.__name__))
+        self._blocking[func] = blocking
+        if timeout is not None:
+            self._timeouts[func] = timeout
+
+    def _on_command_done(self, task):
+        self._command_slots.release()
+        if not task.cancelled() and task.exception() is not None:
+            exception = task.exception()
+            self._log_exception(''.join(traceback.format_exception(type(exception), exception,
+                                                                   exception.__traceback__)))
+
+    @staticmethod
+    def _log_exception(trace):
+        log = open('log.txt', 'a+')
+        log.writelines(str(datetime.now()) + ":\n " + trace + "\n\n")
+        log.close()
+        print(trace)
+
+    def _add_command(self, func, aliases=None):
+        for name in [func.__name__] + list(aliases or []):
+            self.commands[name] = func
+            self.index.add(name, func.__name__)
+
+    def register_aliases(self, aliases=None, blocking=False, timeout=None):
         """Registers a command under the function name & any names specified in aliases.
         """
 
         def func_wrapper(func):
-            self.commands[func.__name__] = func
-            for alias in aliases:
-                self.commands[alias] = func
+            self._set_mode(func, blocking, timeout)
+            self._add_command(func, aliases)
             return func
 
         return func_wrapper
 
-    def register_extras(self, is_hidden=False, aliases=None, on_connect_listener=None):
+    def register_extras(self, is_hidden=False, aliases=None, on_connect_listener=None, blocking=False, timeout=None):
         """Registers a function as hidden with aliases, or any combination of that."""
 
         def func_wrapper(func):
+            self._set_mode(func, blocking, timeout)
             if is_hidden and aliases:
                 self.hidden_commands[func.__name__] = func
                 for alias in aliases:
                     self.hidden_commands[alias] = func
-            elif aliases:
-                self.commands[func.__name__] = func
-                for alias in aliases:
-                    self.commands[alias] = func
             elif is_hidden:
                 self.hidden_commands[func.__name__] = func
             else:
-                self.commands[func.__name__] = func
+                self._add_command(func, aliases)
             return func
 
         self.on_connect_listeners.append(on_connect_listener)
 
         return func_wrapper
 
-    def register(self, func):
-        """Decorator for registering command"""
-        self.commands[func.__name__] = func
-        return func
+    def register(self, func=None, blocking=False, timeout=None):
+        """Decorator for registering command. Use as @register, or as @register(blocking=..., timeout=...)"""
+
+        def func_wrapper(func):
+            self._set_mode(func, blocking, timeout)
+            self._add_command(func)
+            return func
 
-    def register_hidden(self, func):
+        return func_wrapper(func) if func is not None else func_wrapper
+
+    def register_hidden(self, func=None, blocking=False, timeout=None):
         """Registers a command as hidden (This makes it only runnable by the Bot and it won't appear in the help menu)"""
-        self.hidden_commands[func.__name__] = func
-        return func
 
-    def register_unknown(self, func):
-        self.unknown_command = func
-        return func
+        def func_wrapper(func):
+            self._set_mode(func, blocking, timeout)
+            self.hidden_commands[func.__name__] = func
+            return func
+
+        return func_wrapper(func) if func is not None else func_wrapper
+
+    def register_unknown(self, func=None, blocking=False, timeout=None):
+
+        def func_wrapper(func):
+            self._set_mode(func, blocking, timeout)
+            self.unknown_command = func
+            return func
+
+        return func_wrapper(func) if func is not None else func_wrapper
 
     def register_on_connect_listener(self, func):
         self.on_connect_listeners.append(func)
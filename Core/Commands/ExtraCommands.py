@@ -1,24 +1,21 @@
 import asyncio
 from datetime import timedelta, datetime
 from fractions import Fraction
-import glob
-import json
-import os
 import random
-import threading
-from urllib import parse, request
-from bs4 import BeautifulSoup
-from dateutil import parser
-import dateutil
+from urllib import parse
+from urllib.error import HTTPError, URLError
 import hangups
-import re
-import requests
-import parsedatetime
 from Core.Commands.Dispatcher import DispatcherSingleton
-from Core.Util import UtilBot
-from Libraries import Genius
+from Core.Util import UtilBot, AsyncDB, UtilHTTP, UtilRecords, Levenshtein
+from Core.Util.HashtagSegmenter import find_hashtags
+from Core.Util.ResultCache import CommandCache
+from Core.Util.ReminderScheduler import ReminderScheduler
+from Core.Util.LazyImport import lazy_import
 
-currently_running_reminders = []
+# Only a few commands need these.
+parser = lazy_import('dateutil.parser')
+parsedatetime = lazy_import('parsedatetime')
+Genius = lazy_import('Libraries.Genius')
 
 
 @DispatcherSingleton.register
@@ -29,6 +26,37 @@ def count(bot, event, *args):
                      '"' + words + '"' + " has " + str(count) + (' syllable.' if count == 1 else ' syllables.'))
 
 
+@DispatcherSingleton.register
+def unhashtag(bot, event, *args):
+    """
+    **Unhashtag:**
+    Usage: /unhashtag <text with #hashtags> {/unhashtag #throwbackthursday}
+    Purpose: Splits hashtags into words. Anything that isn't a word is shown in [brackets].
+    """
+    text = ' '.join(args)
+    if '#' not in text:
+        text = '#' + text.replace(' ', '')
+    split = UtilBot.unhashtag(text)
+    if split:
+        bot.send_message(event.conv, ''.join(split).strip())
+    else:
+        bot.send_message(event.conv, 'No hashtags found.')
+
+
+@DispatcherSingleton.register_hidden
+def _unhashtag(bot, event, *args):
+    """For autoreplies, e.g. [["^.*#[a-zA-Z]+.*$"], "/_unhashtag {}"]: spells out hashtags that split cleanly into
+    words."""
+    segmenter = UtilBot.get_hashtag_segmenter()
+    lines = []
+    for tag in find_hashtags(' '.join(args)):
+        pieces = segmenter.segment(tag)
+        if len(pieces) > 1 and all(is_word for _, is_word in pieces):
+            lines.append('#{}: {}'.format(tag, ' '.join(piece for piece, _ in pieces)))
+    if lines:
+        bot.send_message(event.conv, '\n'.join(lines))
+
+
 @DispatcherSingleton.register
 def udefine(bot, event, *args):
     if ''.join(args) == '?':
@@ -56,13 +84,20 @@ def udefine(bot, event, *args):
                 args = args[:-1]
 
             term = parse.quote('.'.join(args))
-            response = requests.get(api_host + term)
             error_response = 'No definition found for \"{}\".'.format(' '.join(args))
-            if response.status_code != 200:
-                bot.send_message(event.conv, error_response)
-            result = response.content.decode()
-            result_list = json.loads(result)
-            if len(result_list) == 0:
+
+            @asyncio.coroutine
+            def lookup():
+                try:
+                    response = yield from UtilHTTP.fetch(api_host + term, raise_for_status=False)
+                except URLError:
+                    return None
+                if response.status != 200:
+                    return None
+                return response.json()
+
+            result_list = yield from CommandCache.get_or_fetch('udefine', args, lookup)
+            if not result_list:
                 bot.send_message(event.conv, error_response)
                 return
             num_requested = min(num_requested, len(result_list) - 1)
@@ -83,27 +118,34 @@ def udefine(bot, event, *args):
                 bot.send_message_segments(event.conv, segments)
 
 
+_reminder_scheduler = None
+
+
 # Function for sending reminders to a chat.
-def send_reminder(bot, conv, reminder_time, reminder_text, loop):
-    asyncio.set_event_loop(loop)
-    bot.send_message(conv, "Reminder: " + reminder_text)
-    UtilBot.delete_reminder(conv.id_, reminder_text, reminder_time)
+@asyncio.coroutine
+def send_reminder(bot, reminder_id, conv_id, reminder_text):
+    try:
+        conv = bot._conv_list.get(conv_id)
+    except KeyError:
+        print('Dropping reminder for unknown conversation {}'.format(conv_id))
+    else:
+        bot.send_message(conv, "Reminder: " + reminder_text)
+    yield from AsyncDB.delete_reminder(reminder_id)
 
 
 def _reminder_on_connect_listener(bot):
-    reminders = UtilBot.get_all_reminders()
-    for reminder in reminders:
-        reminder_time = dateutil.parser.parse(reminder[2])
-        reminder_interval = (reminder_time - datetime.now()).seconds
-        conv = bot._conv_list.get(reminder[0])
-        reminder_timer = threading.Timer(reminder_interval, send_reminder,
-                                         [bot, conv, reminder_interval, reminder[1], asyncio.get_event_loop()])
-        reminder_timer.start()
+    global _reminder_scheduler
+    if _reminder_scheduler is None:
+        _reminder_scheduler = ReminderScheduler(lambda *reminder: send_reminder(bot, *reminder))
+    # Reconnecting reloads everything from the database rather than doubling up.
+    _reminder_scheduler.clear()
+    for reminder_id, conv_id, reminder_text, reminder_time in UtilBot.get_all_reminders():
+        _reminder_scheduler.add(reminder_id, conv_id, reminder_text, parser.parse(reminder_time))
 
 
 @DispatcherSingleton.register_extras(on_connect_listener=_reminder_on_connect_listener)
 def remind(bot, event, *args):
-    # TODO Implement a private chat feature. Have reminders save across reboots?
+    # TODO Implement a private chat feature.
     """
     **Remind:**
     Usage: /remind <optional: date [defaults to today]> <optional: time [defaults to an hour from now]> <message> {/remind 1/1/15 2:00PM Call mom}
@@ -115,12 +157,12 @@ def remind(bot, event, *args):
     if len(args) == 0:
         segments = [hangups.ChatMessageSegment('Reminders:', is_bold=True),
                     hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK)]
-        reminders = UtilBot.get_all_reminders(event.conv_id)
+        reminders = yield from AsyncDB.get_all_reminders(event.conv_id)
         if len(reminders) > 0:
             for x in range(0, len(reminders)):
                 reminder = reminders[x]
-                reminder_text = reminder[1]
-                date_to_post = dateutil.parser.parse(reminder[2])
+                reminder_text = reminder[2]
+                date_to_post = parser.parse(reminder[3])
                 segments.append(
                     hangups.ChatMessageSegment(
                         str(x + 1) + ' - ' + date_to_post.strftime('%m/%d/%y %I:%M%p') + ' : ' + reminder_text))
@@ -139,13 +181,14 @@ def remind(bot, event, *args):
         except ValueError:
             bot.send_message(event.conv, 'Invalid integer: ' + args[1])
             return
-        reminders = UtilBot.get_all_reminders(event.conv_id)
+        reminders = yield from AsyncDB.get_all_reminders(event.conv_id)
         reminder_to_delete_text = None
         if x in range(0, len(reminders)):
-            to_delete_reminder = reminders[x]
-            for running_reminder in currently_running_reminders:
-                if running_reminder[1] == to_delete_reminder:
-                    running_reminder[0].cancel()
+            reminder_id, conv_id, reminder_text, reminder_time = reminders[x]
+            if (yield from AsyncDB.delete_reminder(reminder_id)):
+                reminder_to_delete_text = reminder_text
+            if _reminder_scheduler is not None:
+                _reminder_scheduler.cancel(reminder_id)
         if reminder_to_delete_text:
             bot.send_message(event.conv, 'Removed reminder: ' + str(reminder_to_delete_text))
         else:
@@ -168,18 +211,49 @@ def remind(bot, event, *args):
 
     current_time = datetime.now()
     if reminder_time < current_time:
-        bot.send_message("Invalid Date: {}".format(reminder_time.strftime('%B %d, %Y %I:%M%p')))
-
-    reminder_interval = (reminder_time - current_time).total_seconds()
+        bot.send_message(event.conv, "Invalid Date: {}".format(reminder_time.strftime('%B %d, %Y %I:%M%p')))
+        return
 
-    reminder_timer = threading.Timer(reminder_interval, send_reminder,
-                                     [bot, event.conv, reminder_interval, reminder_text, asyncio.get_event_loop()])
-    UtilBot.add_reminder(event.conv_id, reminder_text, reminder_time)
-    reminder_timer.start()
-    currently_running_reminders.append((reminder_timer, (event.conv_id, reminder_text, reminder_time)))
+    reminder_id = yield from AsyncDB.add_reminder(event.conv_id, reminder_text, reminder_time)
+    if _reminder_scheduler is not None:
+        _reminder_scheduler.add(reminder_id, event.conv_id, reminder_text, reminder_time)
     bot.send_message(event.conv, "Reminder set for " + reminder_time.strftime('%B %d, %Y %I:%M%p'))
 
 
+@asyncio.coroutine
+def _find_next_lyric(lyric):
+    """Finds the song lyric is from, and returns [the line following lyric, song name] (or None)."""
+    try:
+        search_soup = yield from UtilHTTP.fetch_soup(Genius.build_search_url(lyric))
+        songs = Genius.parse_search(search_soup)
+        if len(songs) < 1:
+            return None
+        song_soup = yield from UtilHTTP.fetch_soup(songs[0].url)
+        lyrics = Genius.parse_lyrics(song_soup)
+    except (HTTPError, URLError):
+        return None
+    lyrics = lyrics.split('\n')
+    # The last line has nothing after it to finish with.
+    candidates = [x for x in range(len(lyrics) - 1) if lyrics[x].strip()]
+    # The line closest to lyric, and whether it was longer than lyric (and so only partly matched).
+    best = Levenshtein.best_match(lyric, [lyrics[x] for x in candidates])
+    if best is None:
+        return None
+    index, _, chopped = best
+    x = candidates[index]
+    next = UtilBot.find_next_non_blank(lyrics, x)
+    if next is None:
+        return None
+    found_lyric = lyrics[x] + " " + lyrics[next] if chopped else lyrics[next]
+    if found_lyric.startswith('['):
+        # A section heading like [Chorus]; its lines follow where it first appears.
+        next = UtilBot.find_next_non_blank(lyrics, lyrics.index(found_lyric))
+        if next is None:
+            return None
+        found_lyric = lyrics[next]
+    return [found_lyric, songs[0].name]
+
+
 @DispatcherSingleton.register
 def finish(bot, event, *args):
     if ''.join(args) == '?':
@@ -196,42 +270,15 @@ def finish(bot, event, *args):
             showguess = True
             args = args[0:-1]
         lyric = ' '.join(args)
-        songs = Genius.search_songs(lyric)
-
-        if len(songs) < 1:
+        found = yield from CommandCache.get_or_fetch('finish', [lyric], lambda: _find_next_lyric(lyric))
+        if found is None:
             bot.send_message(event.conv, "I couldn't find your lyrics.")
-        lyrics = songs[0].raw_lyrics
-        anchors = {}
-
-        lyrics = lyrics.split('\n')
-        currmin = (0, UtilBot.levenshtein_distance(lyrics[0], lyric)[0])
-        for x in range(1, len(lyrics) - 1):
-            try:
-                currlyric = lyrics[x]
-                if not currlyric.isspace():
-                    # Returns the distance and whether or not the lyric had to be chopped to compare
-                    result = UtilBot.levenshtein_distance(currlyric, lyric)
-                else:
-                    continue
-                distance = abs(result[0])
-                lyrics[x] = lyrics[x], result[1]
-
-                if currmin[1] > distance:
-                    currmin = (x, distance)
-                if currlyric.startswith('[') and currlyric not in anchors:
-                    next = UtilBot.find_next_non_blank(lyrics, x)
-                    anchors[currlyric] = lyrics[next]
-            except Exception:
-                pass
-        next = UtilBot.find_next_non_blank(lyrics, currmin[0])
-        chopped = lyrics[currmin[0]][1]
-        found_lyric = lyrics[currmin[0]][0] + " " + lyrics[next][0] if chopped else lyrics[next][0]
-        if found_lyric.startswith('['):
-            found_lyric = anchors[found_lyric]
+            return
+        found_lyric, song_name = found
         if showguess:
             segments = [hangups.ChatMessageSegment(found_lyric),
                         hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK),
-                        hangups.ChatMessageSegment(songs[0].name)]
+                        hangups.ChatMessageSegment(song_name)]
             bot.send_message_segments(event.conv, segments)
         else:
             bot.send_message(event.conv, found_lyric)
@@ -239,14 +286,32 @@ def finish(bot, event, *args):
         return
 
 
+def _split_page(args):
+    """Splits a trailing "page <n>" off of args."""
+    if len(args) >= 2 and args[-2].lower() == 'page' and args[-1].isdigit():
+        return args[:-2], max(1, int(args[-1]))
+    return args, 1
+
+
+def _record_segments(title, lines):
+    segments = [hangups.ChatMessageSegment(title, is_bold=True),
+                hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK)]
+    for line in lines:
+        segments.append(hangups.ChatMessageSegment(line))
+        segments.append(hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK))
+        segments.append(hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK))
+    return segments
+
+
 @DispatcherSingleton.register
 def record(bot, event, *args):
     """
     **Record:**
     Usage: /record <text to record>
     Usage: /record date <date to show records from>
-    Usage: /record list
-    Usage: /record search <search term>
+    Usage: /record between <date> and <date> [page <n>]
+    Usage: /record list [page <n>]
+    Usage: /record search <search terms> [page <n>]
     Usage: /record strike
     Usage: /record
     Purpose: Store/Show records of conversations. Note: All records will be prepended by: "On the day of <date>," automatically.
@@ -254,129 +319,107 @@ def record(bot, event, *args):
 
     import datetime
 
-    directory = "Records" + os.sep + str(event.conv_id)
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-    filename = str(datetime.date.today()) + ".txt"
-    filepath = os.path.join(directory, filename)
-    file = None
-
     # Deletes the record for the day.
     if ''.join(args) == "clear":
-        file = open(filepath, "a+")
-        file.seek(0)
-        file.truncate()
+        yield from AsyncDB.run(UtilRecords.clear_day, event.conv_id)
 
     # Shows the record for the day.
     elif ''.join(args) == '':
-        file = open(filepath, "a+")
-        # If the mode is r+, it won't create the file. If it's a+, I have to seek to the beginning.
-        file.seek(0)
-        segments = [hangups.ChatMessageSegment(
-            'On the day of ' + datetime.date.today().strftime('%B %d, %Y') + ':', is_bold=True),
-            hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK)]
-        for line in file:
-            segments.append(
-                hangups.ChatMessageSegment(line))
-            segments.append(hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK))
-            segments.append(hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK))
-        bot.send_message_segments(event.conv, segments)
+        lines = yield from AsyncDB.run(UtilRecords.get_records, event.conv_id)
+        bot.send_message_segments(event.conv, _record_segments(
+            'On the day of ' + datetime.date.today().strftime('%B %d, %Y') + ':', lines))
 
     # Removes the last line recorded, iff the user striking is the same as the person who recorded last.
     elif args[0] == "strike":
         last_recorder = UtilBot.get_last_recorder(event.conv_id)
         last_recorded = UtilBot.get_last_recorded(event.conv_id)
         if event.user.id_ == last_recorder:
-            file = open(filepath, "a+")
-            file.seek(0)
-            file_lines = file.readlines()
-            if last_recorded is not None and last_recorded in file_lines:
-                file_lines.remove(last_recorded)
-            file.seek(0)
-            file.truncate()
-            file.writelines(file_lines)
+            if last_recorded is not None:
+                yield from AsyncDB.run(UtilRecords.delete_record, event.conv_id, last_recorded)
             UtilBot.set_last_recorded(event.conv_id, None)
             UtilBot.set_last_recorder(event.conv_id, None)
         else:
             bot.send_message(event.conv, "You do not have the authority to strike from the Record.")
 
-    # Lists every record available. TODO Paginate this?
+    # Lists every day that has a record, newest first.
     elif args[0] == "list":
-        files = os.listdir(directory)
+        args, page = _split_page(args)
+        days = yield from AsyncDB.run(UtilRecords.list_days, event.conv_id, page)
+        if not days:
+            bot.send_message(event.conv, "No records found." if page == 1 else "No more records.")
+            return
         segments = []
-        for name in files:
-            segments.append(hangups.ChatMessageSegment(name.replace(".txt", "")))
+        for day, count in days:
+            segments.append(hangups.ChatMessageSegment(day + " (" + str(count) + ")"))
             segments.append(hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK))
         bot.send_message_segments(event.conv, segments)
 
-    # Shows a list of records that match the search criteria.
+    # Shows the records that best match the search terms.
     elif args[0] == "search":
-        args = args[1:]
+        args, page = _split_page(args[1:])
         searched_term = ' '.join(args)
-        escaped_args = []
-        for item in args:
-            escaped_args.append(re.escape(item))
-        term = '.*'.join(escaped_args)
-        term = term.replace(' ', '.*')
-        if len(args) > 1:
-            term = '.*' + term
-        else:
-            term = '.*' + term + '.*'
-        foundin = []
-        for name in glob.glob(directory + os.sep + '*.txt'):
-            with open(name) as f:
-                contents = f.read()
-            if re.match(term, contents, re.IGNORECASE | re.DOTALL):
-                foundin.append(name.replace(directory, "").replace(".txt", "").replace("\\", ""))
-        if len(foundin) > 0:
+        found = yield from AsyncDB.run(UtilRecords.search_records, event.conv_id, searched_term.split(), None, None,
+                                       page)
+        if len(found) > 0:
             segments = [hangups.ChatMessageSegment("Found "),
                         hangups.ChatMessageSegment(searched_term, is_bold=True),
                         hangups.ChatMessageSegment(" in:"),
                         hangups.ChatMessageSegment("\n", hangups.SegmentType.LINE_BREAK)]
-            for filename in foundin:
-                segments.append(hangups.ChatMessageSegment(filename))
+            for day, text in found:
+                segments.append(hangups.ChatMessageSegment(day + ": ", is_bold=True))
+                segments.append(hangups.ChatMessageSegment(text))
                 segments.append(hangups.ChatMessageSegment("\n", hangups.SegmentType.LINE_BREAK))
             bot.send_message_segments(event.conv, segments)
         else:
             segments = [hangups.ChatMessageSegment("Couldn't find  "),
                         hangups.ChatMessageSegment(searched_term, is_bold=True),
-                        hangups.ChatMessageSegment(" in any records.")]
+                        hangups.ChatMessageSegment(" in any records." if page == 1 else " in any more records.")]
             bot.send_message_segments(event.conv, segments)
 
+    # Lists the records from a range of dates.
+    elif args[0] == "between":
+        args, page = _split_page(args[1:])
+        dates = ' '.join(args).split(' and ')
+        try:
+            if len(dates) != 2:
+                raise ValueError
+            start, end = sorted(parser.parse(date).date() for date in dates)
+        except Exception as e:
+            bot.send_message(event.conv, "Couldn't parse " + ' '.join(args) + " as a valid date range.")
+            return
+        found = yield from AsyncDB.run(UtilRecords.get_records_between, event.conv_id, start, end, page)
+        if not found:
+            bot.send_message(event.conv, "No records between " + start.strftime('%B %d, %Y') + " and " +
+                             end.strftime('%B %d, %Y') + '.')
+            return
+        segments = []
+        for day, text in found:
+            segments.append(hangups.ChatMessageSegment(day + ": ", is_bold=True))
+            segments.append(hangups.ChatMessageSegment(text))
+            segments.append(hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK))
+        bot.send_message_segments(event.conv, segments)
+
     # Lists a record from the specified date.
     elif args[0] == "date":
-        from dateutil import parser
-
         args = args[1:]
         try:
             dt = parser.parse(' '.join(args))
         except Exception as e:
             bot.send_message(event.conv, "Couldn't parse " + ' '.join(args) + " as a valid date.")
             return
-        filename = str(dt.date()) + ".txt"
-        filepath = os.path.join(directory, filename)
-        try:
-            file = open(filepath, "r")
-        except IOError:
+        lines = yield from AsyncDB.run(UtilRecords.get_records, event.conv_id, dt.date())
+        if not lines:
             bot.send_message(event.conv, "No record for the day of " + dt.strftime('%B %d, %Y') + '.')
             return
-        segments = [hangups.ChatMessageSegment('On the day of ' + dt.strftime('%B %d, %Y') + ':', is_bold=True),
-                    hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK)]
-        for line in file:
-            segments.append(hangups.ChatMessageSegment(line))
-            segments.append(hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK))
-            segments.append(hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK))
-        bot.send_message_segments(event.conv, segments)
+        bot.send_message_segments(event.conv, _record_segments('On the day of ' + dt.strftime('%B %d, %Y') + ':',
+                                                               lines))
 
     # Saves a record.
     else:
-        file = open(filepath, "a+")
-        file.write(' '.join(args) + '\n')
+        record_id = yield from AsyncDB.run(UtilRecords.add_record, event.conv_id, ' '.join(args), event.user.id_.chat_id)
         bot.send_message(event.conv, "Record saved successfully.")
         UtilBot.set_last_recorder(event.conv_id, event.user.id_)
-        UtilBot.set_last_recorded(event.conv_id, ' '.join(args) + '\n')
-    if file is not None:
-        file.close()
+        UtilBot.set_last_recorded(event.conv_id, record_id)
 
 
 @DispatcherSingleton.register
@@ -456,9 +499,13 @@ def quote(bot, event, *args):
         if len(query) > 0:
             QUERY_TYPE = "SEARCH"
         url = "http://www.stands4.com/services/v2/quotes.php?uid=" + USER_ID + "&tokenid=" + DEV_ID + "&searchtype=" + QUERY_TYPE + "&query=" + query
-        soup = BeautifulSoup(request.urlopen(url))
         if QUERY_TYPE == "SEARCH":
-            children = list(soup.results.children)
+            @asyncio.coroutine
+            def search():
+                soup = yield from UtilHTTP.fetch_soup(url)
+                return [[child.quote.text, child.author.text] for child in soup.results.children]
+
+            children = yield from CommandCache.get_or_fetch('quote', args, search)
             numQuotes = len(children)
             if numQuotes == 0:
                 bot.send_message(event.conv, "Unable to find quote.")
@@ -469,8 +516,9 @@ def quote(bot, event, *args):
             elif fetch < 1:
                 fetch = 1
             bot.send_message(event.conv, "\"" +
-                             children[fetch - 1].quote.text + "\"" + ' - ' + children[
-                                 fetch - 1].author.text + ' [' + str(
+                             children[fetch - 1][0] + "\"" + ' - ' + children[
+                                 fetch - 1][1] + ' [' + str(
                 fetch) + ' of ' + str(numQuotes) + ']')
         else:
+            soup = yield from UtilHTTP.fetch_soup(url)
             bot.send_message(event.conv, "\"" + soup.quote.text + "\"" + ' -' + soup.author.text)
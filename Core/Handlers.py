@@ -1,7 +1,4 @@
-from collections import deque
-from datetime import datetime
 import logging
-import shlex
 import asyncio
 import re
 
@@ -11,6 +8,9 @@ from Core.Commands.Dispatcher import DispatcherSingleton
 from Core.Commands import *  # Makes sure that all commands in the Command directory are imported and registered.
 
 from Core.Util.UtilBot import is_user_blocked, check_if_can_run_command
+from Core.Util.AutoreplyEngine import AutoreplyEngine
+from Core.Util.CommandParser import parse_command
+from Core.Util.DuplicateFilter import DuplicateFilter, TIME_OUT
 
 
 class MessageHandler(object):
@@ -19,12 +19,18 @@ class MessageHandler(object):
     def __init__(self, bot, command_char='/'):
         self.bot = bot
         self.command_char = command_char
-        self.command_cache = deque(maxlen=20)
-        self.autoreply_cache = deque(maxlen=20)
-        self.TIME_OUT = 1
+        self.command_cache = DuplicateFilter()
+        self.autoreply_cache = DuplicateFilter()
+        self.TIME_OUT = TIME_OUT  # Overridden by the duplicate_timeout option.
+        self.autoreply_engine = AutoreplyEngine(bot)
         for listener in DispatcherSingleton.on_connect_listeners:
             listener(bot)
 
+    def get_time_out(self, event):
+        """Seconds within which the same command or autoreply from the same user is ignored."""
+        time_out = self.bot.get_config_suboption(event.conv_id, 'duplicate_timeout')
+        return self.TIME_OUT if time_out is None else time_out
+
     def word_in_text(self, word, text):
         """Return True if word is in text"""
 
@@ -37,19 +43,16 @@ class MessageHandler(object):
             return True if re.search('\\b' + word + '\\b', text, re.IGNORECASE) else False
 
     @asyncio.coroutine
-    def handle(self, event):
+    def handle(self, event, shed_autoreplies=False):
         if event.user.is_self or is_user_blocked(event.conv_id, event.user_id):
             return
-        try:
-            muted = not self.bot.config['conversations'][event.conv_id]['autoreplies_enabled']
-        except KeyError:
+        overrides = self.bot.config_resolver.get_overrides(event.conv_id)
+        if 'autoreplies_enabled' in overrides:
+            muted = not overrides['autoreplies_enabled']
+        else:
             muted = False
-            try:
-                self.bot.config['conversations'][event.conv_id]['autoreplies_enabled'] = True
-            except KeyError:
-                self.bot.config['conversations'][event.conv_id] = {}
-                self.bot.config['conversations'][event.conv_id]['autoreplies_enabled'] = True
-                self.bot.config.save()
+            self.bot.set_config_suboption(event.conv_id, 'autoreplies_enabled', True)
+            self.bot.config.save()
 
         event.text = event.text.replace('\xa0', ' ')
 
@@ -66,7 +69,7 @@ class MessageHandler(object):
             else:
                 # Forward messages
                 yield from self.handle_forward(event)
-                if not muted:
+                if not muted and not shed_autoreplies:
                     # Send automatic replies
                     yield from self.handle_autoreply(event)
 
@@ -78,33 +81,26 @@ class MessageHandler(object):
             return
 
         # Parse message
-        line_args = shlex.split(event.text, posix=False)
-        i = 0
-        while i < len(line_args):
-            line_args[i] = line_args[i].strip()
-            if line_args[i] == '' or line_args[i] == '':
-                line_args.remove(line_args[i])
-            else:
-                i += 1
+        parsed = parse_command(event.text, self.command_char)
 
         # Test if command length is sufficient
-        if len(line_args) < 1:
+        if parsed.name is None:
             self.bot.send_message(event.conv,
                                   '{}: Not a valid command.'.format(event.user.full_name))
             return
+        # The same name is checked, deduplicated and run, however the command character was typed ("/ping", "/ ping").
+        command = parsed.name.lower()
 
-        for prev_command in self.command_cache:
-            if prev_command[0] == event.user_id[0] and prev_command[1] == line_args[0] and (
-                        datetime.now() - prev_command[2]).seconds < self.TIME_OUT:
-                self.bot.send_message(event.conv, "Ignored duplicate command from %s." % event.user.full_name)
-                return
-        self.command_cache.append((event.user_id[0], line_args[0], datetime.now()))
+        if self.command_cache.is_duplicate(event.conv_id, event.user_id[0], command, self.get_time_out(event)):
+            self.bot.send_message(event.conv, "Ignored duplicate command from %s." % event.user.full_name)
+            return
+        self.command_cache.add(event.conv_id, event.user_id[0], command)
 
 
         # Test if user has permissions for running command (and subcommand)
-        if check_if_can_run_command(self.bot, event, line_args[0].lower().replace(self.command_char, '')):
+        if check_if_can_run_command(self.bot, event, command):
             # Run command
-            yield from DispatcherSingleton.run(self.bot, event, self.command_char, *line_args[0:])
+            yield from DispatcherSingleton.run(self.bot, event, command, *parsed.args)
         else:
             self.bot.send_message(event.conv,
                                   "Sorry {}, I can't let you do that.".format(event.user.full_name))
@@ -144,29 +140,23 @@ class MessageHandler(object):
         if not self.bot.get_config_suboption(event.conv_id, 'autoreplies_enabled'):
             return
 
-        for prev_auto in self.autoreply_cache:
-            if prev_auto[0] == event.user_id[0] and prev_auto[1] == event.text and (
-                        datetime.now() - prev_auto[2]).seconds < self.TIME_OUT:
-                self.bot.send_message(event.conv, "Ignored duplicate command from %s." % event.user.full_name)
-                return
+        if self.autoreply_cache.is_duplicate(event.conv_id, event.user_id[0], event.text, self.get_time_out(event)):
+            self.bot.send_message(event.conv, "Ignored duplicate command from %s." % event.user.full_name)
+            return
 
-        autoreplies_list = self.bot.get_config_suboption(event.conv_id, 'autoreplies')
-        if autoreplies_list:
-            for kwds, sentence in autoreplies_list:
-                for kw in kwds:
-                    if self.word_in_text(kw, event.text) or kw == "*":
-                        if sentence[0] == self.command_char:
-                            yield from self.bot._client.settyping(event.conv_id)
-                            event.text = sentence.format(event.text)
-
-                            # Cheating so auto-replies come through as System user.
-                            if not event.user.is_self:
-                                event.user.is_self = True
-                                yield from self.handle_command(event)
-                                event.user.is_self = False
-                            else:
-                                yield from self.handle_command(event)
-                            return
-                        else:
-                            self.autoreply_cache.append((event.user_id[0], event.text, datetime.now()))
-                            self.bot.send_message(event.conv, sentence)
\ No newline at end of file
+        for kwds, sentence in self.autoreply_engine.matches(event.conv_id, event.text):
+            if sentence[0] == self.command_char:
+                yield from self.bot._client.settyping(event.conv_id)
+                event.text = sentence.format(event.text)
+
+                # Cheating so auto-replies come through as System user.
+                if not event.user.is_self:
+                    event.user.is_self = True
+                    yield from self.handle_command(event)
+                    event.user.is_self = False
+                else:
+                    yield from self.handle_command(event)
+                return
+            else:
+                self.autoreply_cache.add(event.conv_id, event.user_id[0], event.text)
+                self.bot.send_message(event.conv, sentence)
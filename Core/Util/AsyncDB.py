@@ -0,0 +1,166 @@
+import asyncio
+from concurrent.futures import Future
+import queue
+import threading
+import traceback
+
+from Core.Util import UtilDB, UtilBot
+
+''' Coroutine versions of the UtilDB and UtilBot database helpers. Every query is handed to a single database thread
+through a bounded queue, so a slow disk never stalls the event loop. Writes that pile up while the thread is busy are
+committed together in one transaction (one fsync instead of one per write).
+
+Use them from commands with yield from, e.g.:
+    new_karma = yield from AsyncDB.change_karma(user_id, 1)'''
+
+QUEUE_SIZE = 1024
+BATCH_SIZE = 64
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+class _DatabaseWorker(threading.Thread):
+    def __init__(self):
+        super().__init__(name='AsyncDB', daemon=True)
+        self.jobs = queue.Queue(maxsize=QUEUE_SIZE)
+
+    def run(self):
+        running = True
+        while running:
+            batch = [self.jobs.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [job for job in batch if job is not None]
+            self._run_batch(batch)
+
+    @staticmethod
+    def _run_batch(batch):
+        results = []
+        try:
+            with UtilDB.transaction():
+                for future, func, args in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        # A job that fails leaves nothing behind, without undoing the rest of the batch.
+                        with UtilDB.savepoint():
+                            result = func(*args)
+                        results.append((future, result, None))
+                    except Exception as e:
+                        results.append((future, None, e))
+        except Exception as e:
+            # The commit itself failed, so none of the batch made it to disk.
+            traceback.print_exc()
+            for future, func, args in batch:
+                if future.running():
+                    future.set_exception(e)
+            return
+        for future, result, exception in results:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+
+def _get_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = _DatabaseWorker()
+            _worker.start()
+        return _worker
+
+
+@asyncio.coroutine
+def run(func, *args):
+    """Runs func(*args) on the database thread and returns its result."""
+    future = Future()
+    job = (future, func, args)
+    jobs = _get_worker().jobs
+    try:
+        jobs.put_nowait(job)
+    except queue.Full:
+        # Wait for room on a spare thread rather than blocking every conversation.
+        yield from asyncio.get_event_loop().run_in_executor(None, jobs.put, job)
+    return (yield from asyncio.wrap_future(future))
+
+
+def shutdown():
+    """Finishes every queued query and stops the database thread."""
+    global _worker
+    with _worker_lock:
+        if _worker is not None and _worker.is_alive():
+            _worker.jobs.put(None)
+            _worker.join()
+        _worker = None
+
+
+@asyncio.coroutine
+def execute(sql, params=()):
+    return (yield from run(UtilDB.execute, sql, params))
+
+
+@asyncio.coroutine
+def fetchone(sql, params=()):
+    return (yield from run(UtilDB.fetchone, sql, params))
+
+
+@asyncio.coroutine
+def fetchall(sql, params=()):
+    return (yield from run(UtilDB.fetchall, sql, params))
+
+
+@asyncio.coroutine
+def get_value_by_user_id(table, user_id, conv_id=None):
+    return (yield from run(UtilDB.get_value_by_user_id, table, user_id, conv_id))
+
+
+@asyncio.coroutine
+def get_values_by_user_id(table, user_id, conv_id=None):
+    return (yield from run(UtilDB.get_values_by_user_id, table, user_id, conv_id))
+
+
+@asyncio.coroutine
+def get_values_for_users(table, user_ids, conv_id=None):
+    return (yield from run(UtilDB.get_values_for_users, table, list(user_ids), conv_id))
+
+
+@asyncio.coroutine
+def set_value_by_user_id(table, user_id, keyword, value, conv_id=None):
+    return (yield from run(UtilDB.set_value_by_user_id, table, user_id, keyword, value, conv_id))
+
+
+@asyncio.coroutine
+def change_karma(user_id, karma):
+    return (yield from run(UtilBot.change_karma, user_id, karma))
+
+
+@asyncio.coroutine
+def get_current_karma(user_id):
+    return (yield from run(UtilBot.get_current_karma, user_id))
+
+
+@asyncio.coroutine
+def get_karma_for_users(user_ids):
+    return (yield from run(UtilBot.get_karma_for_users, list(user_ids)))
+
+
+@asyncio.coroutine
+def add_reminder(conv_id, message, time):
+    return (yield from run(UtilBot.add_reminder, conv_id, message, time))
+
+
+@asyncio.coroutine
+def get_all_reminders(conv_id=None):
+    return (yield from run(UtilBot.get_all_reminders, conv_id))
+
+
+@asyncio.coroutine
+def delete_reminder(reminder_id):
+    return (yield from run(UtilBot.delete_reminder, reminder_id))
@@ -0,0 +1,151 @@
+import re
+
+''' Compiles a conversation's autoreply rules ([keywords, sentence] pairs) into as few regexes as possible, so a chat line
+is matched against every rule with a single scan per regex instead of one regex compile per keyword.
+
+Keywords keep the semantics MessageHandler.word_in_text has always had:
+    "^...$"          -> a case-sensitive regex matched against the start of the text.
+    non-ASCII/escaped -> a case-sensitive plain substring.
+    anything else    -> a case-insensitive whole-word regex ('\\b' + keyword + '\\b').
+    "*"              -> matches everything.'''
+
+
+def _is_anchored(keyword):
+    return keyword[0] == '^' and keyword[-1] == '$'
+
+
+def _is_plain(keyword):
+    return keyword != keyword.encode('unicode-escape').decode()
+
+
+class AutoreplyMatcher(object):
+    """Matches text against a compiled list of autoreply rules."""
+
+    def __init__(self, autoreplies):
+        self.rules = [(kwds, sentence) for kwds, sentence in (autoreplies or [])]
+        self._wildcard = None  # Index of the first rule containing "*", if any.
+        self._standalone = []  # (rule index, compiled regex, is_anchored) for keywords that can't be combined.
+        sensitive = []
+        insensitive = []
+
+        for index, (kwds, sentence) in enumerate(self.rules):
+            for kw in kwds:
+                if not kw:
+                    continue
+                if kw == '*':
+                    if self._wildcard is None:
+                        self._wildcard = index
+                elif _is_anchored(kw):
+                    # \A keeps re.match semantics once the pattern is scanned at every position.
+                    self._add_pattern(sensitive, index, '\\A(?:' + kw + ')', 0, anchored=True)
+                elif _is_plain(kw):
+                    sensitive.append((index, re.escape(kw)))
+                else:
+                    self._add_pattern(insensitive, index, '\\b(?:' + kw + ')\\b', re.IGNORECASE)
+
+        self._sensitive = self._combine(sensitive, 0)
+        self._insensitive = self._combine(insensitive, re.IGNORECASE)
+
+    def _add_pattern(self, patterns, index, pattern, flags, anchored=False):
+        try:
+            compiled = re.compile(pattern, flags)
+        except re.error as e:
+            print('Ignoring invalid autoreply keyword {}: {}'.format(repr(pattern), e))
+            return
+        # Patterns with their own groups would have their backreferences renumbered once they're combined.
+        if compiled.groups:
+            self._standalone.append((index, compiled, anchored))
+        else:
+            patterns.append((index, pattern))
+
+    def _combine(self, patterns, flags):
+        """Builds one regex that, at every position of the text, reports the lowest-indexed rule matching there."""
+        if not patterns:
+            return None
+        by_rule = {}
+        for index, pattern in patterns:
+            if pattern not in by_rule.setdefault(index, []):
+                by_rule[index].append(pattern)
+        alternatives = ['(?P<r{}>{})'.format(index, '|'.join(by_rule[index])) for index in sorted(by_rule)]
+        combined = '(?=' + '|'.join(alternatives) + ')'
+        try:
+            return re.compile(combined, flags)
+        except re.error:
+            # Fall back to matching each keyword on its own rather than losing the whole rule set.
+            for index, pattern in patterns:
+                self._standalone.append((index, re.compile(pattern, flags), False))
+            return None
+
+    @staticmethod
+    def _scan(regex, text, found, limit):
+        for match in regex.finditer(text):
+            index = int(match.lastgroup[1:])
+            found.add(index)
+            if limit is not None and index <= limit:
+                return
+
+    def matched_rules(self, text, first_only=False):
+        """Returns the indices of every rule matching text, in rule order."""
+        found = set()
+        if self._wildcard is not None:
+            found.add(self._wildcard)
+            if first_only and self._wildcard == 0:
+                return [0]
+        limit = 0 if first_only else None
+        if self._sensitive is not None:
+            self._scan(self._sensitive, text, found, limit)
+        if self._insensitive is not None and not (first_only and 0 in found):
+            self._scan(self._insensitive, text, found, limit)
+        for index, regex, anchored in self._standalone:
+            if index in found:
+                continue
+            if regex.match(text) if anchored else regex.search(text):
+                found.add(index)
+        result = sorted(found)
+        return result[:1] if first_only else result
+
+    def match(self, text):
+        """Returns the first [keywords, sentence] rule that matches text, or None."""
+        matched = self.matched_rules(text, first_only=True)
+        return self.rules[matched[0]] if matched else None
+
+    def matches(self, text):
+        """Returns every [keywords, sentence] rule that matches text, in rule order."""
+        return [self.rules[index] for index in self.matched_rules(text)]
+
+
+class AutoreplyEngine(object):
+    """Keeps one compiled AutoreplyMatcher per conversation, rebuilding it only when its autoreplies change."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._matchers = {}
+
+    def get_matcher(self, conv_id):
+        # The resolved config hands back the same frozen autoreplies until that conversation's config changes, and
+        # even then the rules usually compare equal (e.g. after /mute), so the matcher is only recompiled when they don't.
+        autoreplies = self.bot.get_config_suboption(conv_id, 'autoreplies')
+        try:
+            cached_autoreplies, matcher = self._matchers[conv_id]
+            if cached_autoreplies is autoreplies:
+                return matcher
+            if cached_autoreplies == autoreplies:
+                self._matchers[conv_id] = (autoreplies, matcher)
+                return matcher
+        except KeyError:
+            pass
+        matcher = AutoreplyMatcher(autoreplies)
+        self._matchers[conv_id] = (autoreplies, matcher)
+        return matcher
+
+    def invalidate(self, conv_id=None):
+        if conv_id is None:
+            self._matchers.clear()
+        else:
+            self._matchers.pop(conv_id, None)
+
+    def match(self, conv_id, text):
+        return self.get_matcher(conv_id).match(text)
+
+    def matches(self, conv_id, text):
+        return self.get_matcher(conv_id).matches(text)
@@ -0,0 +1,135 @@
+from bisect import bisect_left, insort
+
+''' Index of the commands users can run, kept by the CommandDispatcher as commands are registered.
+
+Names (including aliases) are kept sorted, so the commands starting with a prefix are a bisect away, and bucketed by
+length, so finding the commands within a small edit distance of a typo only has to look at names of about the same
+length. Which commands a user may run depends only on the conversation's config and on whether the user is an admin
+and/or allowed to run conversation admin commands, so the visible list is worked out once per conversation and kind of
+user, and kept until the conversation's config view (see ConfigResolver) is replaced.'''
+
+MAX_SUGGESTIONS = 3
+
+
+def access(conv_config, user_id):
+    """Returns (is_admin, may_run_conversation_admin_commands) for user_id under conv_config."""
+    admins = conv_config.get('admins')
+    conv_admin = conv_config.get('conversation_admin')
+    is_admin = bool(admins) and user_id in admins
+    return is_admin, not admins or user_id in admins or not conv_admin or user_id == conv_admin
+
+
+def can_run(conv_config, user_access, command):
+    is_admin, is_conv_admin = user_access
+    if not is_conv_admin:
+        commands_conv_admin = conv_config.get('commands_conversation_admin')
+        if commands_conv_admin and command in commands_conv_admin:
+            return False
+    if not is_admin:
+        commands_admin = conv_config.get('commands_admin')
+        if commands_admin and command in commands_admin:
+            return False
+    return True
+
+
+def bounded_distance(a, b, bound):
+    """Edit distance between a and b, counting swapped neighbouring letters as one edit, or None if it's more than
+    bound."""
+    if abs(len(a) - len(b)) > bound:
+        return None
+    before_previous = None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+            if i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                cost = min(cost, before_previous[j - 2] + 1)
+            current.append(cost)
+        if min(current) > bound:
+            return None
+        before_previous, previous = previous, current
+    return previous[-1] if previous[-1] <= bound else None
+
+
+class CommandIndex(object):
+    """Sorted, prefix and typo searchable index of command names and aliases."""
+
+    def __init__(self):
+        self._names = []
+        self._by_length = {}
+        self._canonical = {}  # Name or alias -> name of the function it runs.
+        self._aliases = {}  # Function name -> its aliases.
+        self._visible = {}  # conv_id -> (conv config view, {user access: tuple of names})
+
+    def add(self, name, func_name=None):
+        func_name = func_name or name
+        if name not in self._canonical:
+            insort(self._names, name)
+            self._by_length.setdefault(len(name), []).append(name)
+        self._canonical[name] = func_name
+        if name != func_name and name not in self._aliases.setdefault(func_name, []):
+            self._aliases[func_name].append(name)
+        self._visible.clear()
+
+    def __contains__(self, name):
+        return name in self._canonical
+
+    def __len__(self):
+        return len(self._names)
+
+    @property
+    def names(self):
+        return tuple(self._names)
+
+    def canonical(self, name):
+        return self._canonical.get(name)
+
+    def aliases(self, func_name):
+        return tuple(sorted(self._aliases.get(func_name, ())))
+
+    def with_prefix(self, prefix):
+        start = bisect_left(self._names, prefix)
+        end = start
+        while end < len(self._names) and self._names[end].startswith(prefix):
+            end += 1
+        return self._names[start:end]
+
+    def similar(self, word, max_distance=2):
+        """Returns (distance, name) pairs for the names within max_distance edits of word, closest first."""
+        matches = []
+        for length in range(max(1, len(word) - max_distance), len(word) + max_distance + 1):
+            for name in self._by_length.get(length, ()):
+                distance = bounded_distance(word, name, max_distance)
+                if distance is not None:
+                    matches.append((distance, name))
+        matches.sort()
+        return matches
+
+    def visible(self, conv_id, conv_config, user_id):
+        """Returns the sorted names user_id may run in the conversation."""
+        user_access = access(conv_config, user_id)
+        cached = self._visible.get(conv_id)
+        if cached is None or cached[0] is not conv_config:
+            cached = self._visible[conv_id] = (conv_config, {})
+        try:
+            return cached[1][user_access]
+        except KeyError:
+            pass
+        names = tuple(name for name in self._names if can_run(conv_config, user_access, name))
+        cached[1][user_access] = names
+        return names
+
+    def suggest(self, word, conv_id, conv_config, user_id, limit=MAX_SUGGESTIONS):
+        """Returns up to limit commands the user may have meant by word: ones it's the start of, then close typos."""
+        if not word:
+            return []
+        word = word.lower()
+        visible = set(self.visible(conv_id, conv_config, user_id))
+        suggestions = [name for name in self.with_prefix(word) if name in visible]
+        suggestions.sort(key=len)
+        max_distance = 1 if len(word) <= 4 else 2
+        for _, name in self.similar(word, max_distance):
+            if name in visible and name not in suggestions:
+                suggestions.append(name)
+        return suggestions[:limit]
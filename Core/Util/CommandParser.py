@@ -0,0 +1,44 @@
+from collections import namedtuple
+from functools import lru_cache
+import re
+
+''' Splits command messages into their arguments in a single regex pass.
+
+Tokens are split the way shlex.split(text, posix=False) split them: on spaces, tabs and newlines, except inside a
+quoted argument ("like this" or 'like this'), which keeps its quotes and ends at the closing quote. Unlike shlex, an
+unclosed quote isn't an error, it just runs to the end of the message. As before, tokens are stripped of any other
+whitespace (like non-breaking spaces) and dropped if that leaves them empty.
+
+Parsing is cached, since the same commands (and the same autoreply-triggered commands) come up over and over.'''
+
+CACHE_SIZE = 512
+
+_TOKEN = re.compile(r'"[^"]*"|\'[^\']*\'|["\'][\s\S]*|[^ \t\r\n"\'][^ \t\r\n]*')
+
+# name: the command, without the command character (None if there isn't one).
+# args: tuple of the arguments after it.
+# tail: the text after the command, as typed.
+# tokens: tuple of every token, including the command character and command, as the dispatcher expects them.
+ParsedCommand = namedtuple('ParsedCommand', ['name', 'args', 'tail', 'tokens'])
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_command(text, command_char='/'):
+    tokens = []
+    ends = []
+    for match in _TOKEN.finditer(text):
+        token = match.group().strip()
+        if token:
+            tokens.append(token)
+            ends.append(match.end())
+    tokens = tuple(tokens)
+
+    command_char = command_char.strip()
+    name_index = 1 if tokens and tokens[0] == command_char else 0  # Like "/bot ping", or "/ ping".
+    if name_index >= len(tokens):
+        return ParsedCommand(None, (), '', tokens)
+    name = tokens[name_index]
+    if name.startswith(command_char):
+        # Tokens only split on ASCII whitespace, so "/\u3000ping" leaves other whitespace in front of the name.
+        name = name[len(command_char):].strip()
+    return ParsedCommand(name or None, tokens[name_index + 1:], text[ends[name_index]:].strip(), tokens)
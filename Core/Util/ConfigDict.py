@@ -1,30 +1,235 @@
-import collections, functools, json
+import asyncio, atexit, collections, functools, json, os, tempfile, threading, traceback
+
+_MISSING = object()
+
+
+def diff(old, new, path=()):
+    """Yield (path, value) for every value that differs between two configs, descending into dicts. value is _MISSING
+    where a key was removed"""
+    for key in old:
+        if key not in new:
+            yield list(path) + [key], _MISSING
+    for key, value in new.items():
+        old_value = old.get(key, _MISSING)
+        if isinstance(old_value, dict) and isinstance(value, dict):
+            yield from diff(old_value, value, tuple(path) + (key,))
+        elif old_value is _MISSING or old_value != value or type(old_value) != type(value):
+            yield list(path) + [key], value
 
 
 class ConfigDict(collections.MutableMapping):
     """Configuration JSON storage class"""
 
-    def __init__(self, filename, default=None):
+    def __init__(self, filename, default=None, save_delay=0, loop=None):
         self.filename = filename
         self.default = None
         self.config = {}
+        self.version = 0  # Bumped whenever the config is (re)loaded or changed, so derived caches know to rebuild.
+        self._observers = []
+
+        # With a save_delay, save() only marks the config dirty. Once the delay is up the config is serialized on the
+        # event loop (where everything that changes it runs, so the snapshot is consistent) and a background thread
+        # writes the text, so a burst of saves turns into a single write and the event loop never waits on the disk.
+        self.save_delay = save_delay
+        self.loop = loop  # The event loop the config is changed on; asyncio.get_event_loop() if not given.
+        self._dirty = False
+        self._timer = None
+        self._pending = None  # (snapshot number, text) waiting for the writer thread.
+        self._snapshots = 0
+        self._written = 0  # Number of the newest snapshot written, so an older one is never written over it.
+        self._pending_lock = threading.Lock()  # Only ever held briefly, never while writing or serializing.
+        self._write_lock = threading.Lock()  # Held while writing; the event loop thread never waits on it.
+        self._writer = None
+        self._disk_text = None  # What the file held when it was last loaded or written by us.
+        self._writes = 0  # Number of writes so far, so reload can tell if one happened while it was applying changes.
+        if save_delay:
+            atexit.register(self.flush)
+
         self.load()
 
+    def add_observer(self, callback):
+        """Calls callback(path) after every change, with the list of keys that changed, or None if the whole config
+        was replaced"""
+        self._observers.append(callback)
+
+    def changed(self, path=None):
+        """Notify observers of a change made directly to a nested value"""
+        self.version += 1
+        for callback in self._observers:
+            callback(path)
+
     def load(self):
-        """Load config from file"""
+        """Load config from file. Call flush (or flush_async) first to keep unsaved changes"""
         try:
-            self.config = json.loads(open(self.filename, encoding='utf-8').read(), encoding='utf-8')
+            text = open(self.filename, encoding='utf-8').read()
+            self.config = json.loads(text, encoding='utf-8')
         except IOError:
+            text = None
             self.config = {}
+        with self._pending_lock:
+            self._disk_text = text
+        self.changed()
+
+    def reload(self):
+        """Apply only what changed in the file since it was last loaded or saved, leaving unsaved changes alone and
+        notifying observers key by key. Returns the list of changed paths"""
+        with self._pending_lock:
+            disk_text, writes = self._disk_text, self._writes
+        try:
+            text = open(self.filename, encoding='utf-8').read()
+        except IOError:
+            return []
+        if text == disk_text:
+            return []  # Our own write (or nothing changed).
+        try:
+            new = json.loads(text)
+        except ValueError as e:
+            print('Not reloading {}: {}'.format(self.filename, e))
+            return []
+        if not isinstance(new, dict):
+            return []
+        try:
+            old = json.loads(disk_text) if disk_text is not None else {}
+        except ValueError:
+            old = {}
+
+        changes = list(diff(old, new))
+        for path, value in changes:
+            parent = self.config
+            for key in path[:-1]:
+                if not isinstance(parent.get(key), dict):
+                    parent[key] = {}
+                parent = parent[key]
+            if value is _MISSING:
+                parent.pop(path[-1], None)
+            else:
+                parent[path[-1]] = value
+            self.changed(path)
+
+        with self._pending_lock:
+            rewrite = self._writes != writes
+            if not rewrite:
+                self._disk_text = text
+        if rewrite and changes:
+            # A write landed meanwhile, possibly replacing the edit with a config that didn't have all of it yet.
+            self.save()
+        return [path for path, value in changes]
 
     def loads(self, json_str):
         """Load config from JSON string"""
         self.config = json.loads(json_str)
+        self.changed()
 
     def save(self):
-        """Save config to file (only if config has changed)"""
-        with open(self.filename, 'w') as f:
-            json.dump(self.config, f, indent=2, sort_keys=True)
+        """Save config to file (after save_delay seconds, on a background thread, if there is one)"""
+        if not self.save_delay:
+            self._write_snapshot(*self._take_snapshot())
+            return
+        with self._pending_lock:
+            self._dirty = True
+        # Thread-safe, so a command running on the thread pool can save too; the timer itself lives on the loop.
+        self._get_loop().call_soon_threadsafe(self._arm_timer)
+
+    def _get_loop(self):
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+        return self.loop
+
+    def _arm_timer(self):
+        if self._timer is None:
+            self._timer = self.loop.call_later(self.save_delay, self._save_snapshot)
+
+    def _save_snapshot(self):
+        """Runs on the loop once the delay is up: serializes the config and hands the text to the writer thread"""
+        self._timer = None
+        with self._pending_lock:
+            if not self._dirty:
+                return  # Flushed meanwhile.
+        snapshot = self._take_snapshot()
+        with self._pending_lock:
+            self._pending = snapshot
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_pending, name='ConfigDict', daemon=True)
+                self._writer.start()
+
+    def _take_snapshot(self):
+        """Serializes the config. Returns (snapshot number, text)"""
+        with self._pending_lock:
+            # Cleared first, so a save made while serializing still gets written.
+            self._dirty = False
+        text = json.dumps(self.config, indent=2, sort_keys=True)
+        with self._pending_lock:
+            self._snapshots += 1
+            return self._snapshots, text
+
+    def _take_pending(self):
+        """The snapshot a flush should write: a new one if there are unsaved changes, otherwise any the writer thread
+        hasn't picked up yet"""
+        with self._pending_lock:
+            dirty = self._dirty
+            pending, self._pending = self._pending, None
+        return self._take_snapshot() if dirty else pending
+
+    def flush(self):
+        """Write any pending save right away, on the calling thread. Unsaved changes are serialized there too, so only
+        call it while nothing is changing the config (like at exit); on the event loop, use flush_async"""
+        pending = self._take_pending()
+        if pending is not None:
+            self._write_snapshot(*pending)
+
+    @asyncio.coroutine
+    def flush_async(self):
+        """flush for the event loop: serializes on it and waits for the write on the default executor"""
+        pending = self._take_pending()
+        if pending is not None:
+            yield from self._get_loop().run_in_executor(None, self._write_snapshot, *pending)
+
+    def _write_pending(self):
+        while True:
+            with self._pending_lock:
+                pending, self._pending = self._pending, None
+                if pending is None:
+                    self._writer = None
+                    return
+            try:
+                self._write_snapshot(*pending)
+            except Exception:
+                traceback.print_exc()
+
+    def _write_snapshot(self, number, text):
+        with self._write_lock:
+            if number <= self._written:
+                return  # A newer snapshot was already written (by a flush).
+            self._write(text)
+            self._written = number
+
+    def _write(self, text):
+        """Atomically replace the config file, so a crash mid-write can't leave it truncated"""
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, temp_path = tempfile.mkstemp(prefix='.config-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(self.filename):
+                os.chmod(temp_path, os.stat(self.filename).st_mode & 0o777)
+            with self._pending_lock:
+                # Recorded before the file changes, so a reload can't mistake our own write for an edit.
+                previous_text, self._disk_text = self._disk_text, text
+                self._writes += 1
+            try:
+                os.replace(temp_path, self.filename)
+            except BaseException:
+                with self._pending_lock:
+                    self._disk_text = previous_text
+                raise
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
 
     def get_by_path(self, keys_list):
         """Get item from config by path (list of keys)"""
@@ -33,6 +238,7 @@ class ConfigDict(collections.MutableMapping):
     def set_by_path(self, keys_list, value):
         """Set item in config by path (list of keys)"""
         self.get_by_path(keys_list[:-1])[keys_list[-1]] = value
+        self.changed(list(keys_list))
 
     def __getitem__(self, key):
         try:
@@ -42,9 +248,11 @@ class ConfigDict(collections.MutableMapping):
 
     def __setitem__(self, key, value):
         self.config[key] = value
+        self.changed([key])
 
     def __delitem__(self, key):
         del self.config[key]
+        self.changed([key])
 
     def __iter__(self):
         return iter(self.config)
@@ -0,0 +1,92 @@
+from types import MappingProxyType
+
+''' Resolves per-conversation config options without walking the config on every lookup.
+
+For each conversation the global options and the conversation's own overrides are merged once into a read-only view
+(lists become tuples, dicts become read-only mappings, and admin lists become frozensets for fast membership checks).
+Views are cached until the ConfigDict reports a change: a change under conversations/<conv_id> only drops that
+conversation's view, anything else drops them all.'''
+
+# Options holding lists of user ids or command names that are only ever used for membership checks.
+SET_OPTIONS = frozenset(['admins', 'commands_admin', 'commands_conversation_admin'])
+
+_EMPTY = MappingProxyType({})
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _freeze_option(option, value):
+    if option in SET_OPTIONS and isinstance(value, list):
+        try:
+            return frozenset(value)
+        except TypeError:
+            pass
+    return _freeze(value)
+
+
+class ConfigResolver(object):
+    """Cached, merged, read-only config views per conversation."""
+
+    def __init__(self, config):
+        self.config = config
+        self._global = None
+        self._overrides = {}
+        self._views = {}
+        config.add_observer(self._on_config_changed)
+
+    def _on_config_changed(self, path):
+        if path and path[0] == 'conversations' and len(path) > 1:
+            self.invalidate(path[1])
+        else:
+            self.invalidate()
+
+    def invalidate(self, conv_id=None):
+        if conv_id is None:
+            self._global = None
+            self._overrides.clear()
+            self._views.clear()
+        else:
+            self._overrides.pop(conv_id, None)
+            self._views.pop(conv_id, None)
+
+    def _get_global(self):
+        if self._global is None:
+            self._global = {option: _freeze_option(option, value) for option, value in self.config.items()
+                            if option != 'conversations'}
+        return self._global
+
+    def get_overrides(self, conv_id):
+        """Returns only the options set on the conversation itself."""
+        try:
+            return self._overrides[conv_id]
+        except KeyError:
+            pass
+        conversations = self.config['conversations']
+        overrides = conversations.get(conv_id) if isinstance(conversations, dict) else None
+        if isinstance(overrides, dict):
+            overrides = MappingProxyType({option: _freeze_option(option, value) for option, value in overrides.items()})
+        else:
+            overrides = _EMPTY
+        self._overrides[conv_id] = overrides
+        return overrides
+
+    def get(self, conv_id):
+        """Returns the conversation's options merged over the global ones."""
+        try:
+            return self._views[conv_id]
+        except KeyError:
+            pass
+        merged = dict(self._get_global())
+        merged.update(self.get_overrides(conv_id))
+        view = MappingProxyType(merged)
+        self._views[conv_id] = view
+        return view
+
+    def get_option(self, conv_id, option):
+        return self.get(conv_id).get(option)
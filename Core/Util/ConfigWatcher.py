@@ -0,0 +1,115 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import traceback
+
+''' Watches the config file and applies edits to it while the bot is running, without /reload.
+
+On Linux the file's directory is watched with inotify (through ctypes, so nothing extra needs installing); elsewhere,
+or if inotify isn't available, the file is polled. Either way the watcher thread only notices the change: the new file
+is applied on the event loop thread with ConfigDict.reload, which diffs it against what was on disk before and only
+touches (and invalidates caches for) the keys that changed. Writes the bot makes itself are recognized and ignored.'''
+
+POLL_INTERVAL = 2.0
+SETTLE_DELAY = 0.2  # Editors often write a file in several steps, so wait for it to go quiet before reloading.
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def _open_inotify(directory):
+    """Returns an inotify file descriptor watching directory, or None if inotify can't be used."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init()
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(directory),
+                                  _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+
+class ConfigWatcher(threading.Thread):
+    """Reloads config (a ConfigDict) on loop whenever its file changes."""
+
+    def __init__(self, config, loop, poll_interval=POLL_INTERVAL):
+        super().__init__(name='ConfigWatcher', daemon=True)
+        self.config = config
+        self.loop = loop
+        self.poll_interval = poll_interval
+        self._path = os.path.abspath(config.filename)
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        fd = _open_inotify(os.path.dirname(self._path))
+        try:
+            if fd is None:
+                self._poll()
+            else:
+                self._watch(fd)
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def _stat(self):
+        try:
+            stat = os.stat(self._path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _poll(self):
+        last = self._stat()
+        while not self._stopped.wait(self.poll_interval):
+            current = self._stat()
+            if current != last:
+                last = current
+                self._changed()
+
+    def _watch(self, fd):
+        name = os.fsencode(os.path.basename(self._path))
+        changed = False
+        while not self._stopped.is_set():
+            # Wake up now and then to notice stop(); once something changed, wait for the writes to settle.
+            readable, _, _ = select.select([fd], [], [], SETTLE_DELAY if changed else 1.0)
+            if not readable:
+                if changed:
+                    changed = False
+                    self._changed()
+                continue
+            data = os.read(fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                if data[offset:offset + length].rstrip(b'\0') == name:
+                    changed = True
+                offset += length
+
+    def _changed(self):
+        self.loop.call_soon_threadsafe(self._reload)
+
+    def _reload(self):
+        try:
+            changes = self.config.reload()
+        except Exception:
+            traceback.print_exc()
+            return
+        if changes:
+            print('Config reloaded: {}'.format(', '.join('/'.join(str(key) for key in path) for path in changes)))
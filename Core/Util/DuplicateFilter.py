@@ -0,0 +1,53 @@
+from collections import OrderedDict
+import time
+
+''' Remembers what each user recently said in each conversation, so the bot can ignore the same command (or trigger the
+same autoreply) twice in a row.
+
+Entries are keyed on (user id, hash of what was said) in a per-conversation ordered dict, so checking one is a single
+lookup. Entries go in in time order, so the expired ones are always at the front and are dropped from there as the
+conversation is used, and each conversation holds at most capacity entries, so a busy conversation can't push out
+another's.'''
+
+TIME_OUT = 1  # Seconds within which a repeat counts as a duplicate.
+CAPACITY = 20  # Entries kept per conversation.
+
+
+class DuplicateFilter(object):
+    def __init__(self, time_out=TIME_OUT, capacity=CAPACITY):
+        self.time_out = time_out
+        self.capacity = capacity
+        self._conversations = {}  # conv_id -> OrderedDict of (user_id, hash) -> time it was last seen.
+
+    def _expire(self, conv_id, now, time_out):
+        entries = self._conversations.get(conv_id)
+        if entries is None:
+            return None
+        while entries:
+            key, seen = next(iter(entries.items()))
+            if now - seen < time_out:
+                break
+            del entries[key]
+        if not entries:
+            del self._conversations[conv_id]
+            return None
+        return entries
+
+    def is_duplicate(self, conv_id, user_id, text, time_out=None):
+        """Returns True if user_id said text in the conversation within the last time_out seconds."""
+        entries = self._expire(conv_id, time.monotonic(), self.time_out if time_out is None else time_out)
+        return entries is not None and (user_id, hash(text)) in entries
+
+    def add(self, conv_id, user_id, text):
+        entries = self._conversations.setdefault(conv_id, OrderedDict())
+        key = (user_id, hash(text))
+        entries.pop(key, None)
+        entries[key] = time.monotonic()
+        while len(entries) > self.capacity:
+            entries.popitem(last=False)
+
+    def clear(self, conv_id=None):
+        if conv_id is None:
+            self._conversations.clear()
+        else:
+            self._conversations.pop(conv_id, None)
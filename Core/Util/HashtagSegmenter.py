@@ -0,0 +1,80 @@
+from functools import lru_cache
+import re
+
+''' Splits hashtags like #throwbackthursday into words ("throwback thursday").
+
+The word list has no frequencies, so a split's cost stands in for how unlikely it is: every word costs WORD_COST, short
+words that are mostly abbreviations in the list ("ed", "ic"...) cost more, and characters that aren't part of any word
+cost UNKNOWN_COST each. Dynamic programming finds the cheapest split, which favours a few long, common words. At each
+position the words starting there are found by walking the word index like a trie (WordIndex.lookup), stopping as soon
+as no word starts with what's been read, so a tag costs about its length times the longest word tried.
+
+Splits are cached per tag (lower-cased); call clear_cache after adding words to the index.'''
+
+WORD_COST = 1.0
+SHORT_WORD_COST = 2.5  # For one and two letter words that aren't in COMMON_SHORT_WORDS.
+UNKNOWN_COST = 3.0
+CACHE_SIZE = 1024
+
+COMMON_SHORT_WORDS = frozenset(['a', 'i', 'am', 'an', 'as', 'at', 'be', 'by', 'do', 'go', 'he', 'hi', 'if', 'in', 'is',
+                                'it', 'me', 'my', 'no', 'of', 'oh', 'ok', 'on', 'or', 'so', 'to', 'up', 'us', 'we'])
+
+HASHTAG_REGEX = re.compile(r'(#[a-zA-Z]+\'*[a-zA-Z]*)')
+
+
+def _word_cost(word):
+    if len(word) <= 2 and word not in COMMON_SHORT_WORDS:
+        return SHORT_WORD_COST
+    return WORD_COST
+
+
+class HashtagSegmenter(object):
+    """Splits hashtags into the words of a WordIndex."""
+
+    def __init__(self, index, cache_size=CACHE_SIZE):
+        self.index = index
+        self._split = lru_cache(maxsize=cache_size)(self._split_uncached)
+
+    def clear_cache(self):
+        self._split.cache_clear()
+
+    def segment(self, tag):
+        """Splits tag (without the #) into a list of (piece, is_word) pairs, keeping its case."""
+        return [(tag[start:end], is_word) for start, end, is_word in self._split(tag.lower())]
+
+    def _split_uncached(self, text):
+        """Returns the cheapest split of text as a tuple of (start, end, is_word) spans."""
+        n = len(text)
+        best = [0.0] + [None] * n  # Cheapest cost of splitting text[:i]...
+        back = [None] * (n + 1)  # ...and where its last piece starts, and whether that piece is a word.
+        for start in range(n):
+            if best[start] is None:
+                continue
+            cost = best[start] + UNKNOWN_COST
+            if best[start + 1] is None or cost < best[start + 1]:
+                best[start + 1], back[start + 1] = cost, (start, False)
+            for end in range(start + 1, n + 1):
+                piece = text[start:end]
+                is_word, is_prefix = self.index.lookup(piece)
+                if is_word:
+                    cost = best[start] + _word_cost(piece)
+                    if best[end] is None or cost < best[end]:
+                        best[end], back[end] = cost, (start, True)
+                if not is_prefix:
+                    break
+
+        spans = []
+        end = n
+        while end > 0:
+            start, is_word = back[end]
+            if not is_word and spans and not spans[-1][2]:
+                spans[-1] = (start, spans[-1][1], False)  # Run of unknown characters.
+            else:
+                spans.append((start, end, is_word))
+            end = start
+        spans.reverse()
+        return tuple(spans)
+
+
+def find_hashtags(message):
+    return [match[1:] for match in HASHTAG_REGEX.findall(message)]
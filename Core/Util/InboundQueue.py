@@ -0,0 +1,106 @@
+import asyncio
+from collections import deque
+import traceback
+
+''' Feeds incoming chat events to the message handler through a bounded queue and a fixed number of workers, instead of
+starting a task per event. Events from one conversation are handled one at a time and in order; different
+conversations are handled concurrently, up to the number of workers.
+
+When the queue is deeper than shed_depth, events queued as sheddable (plain chat, as opposed to commands) are handed
+to the handler with shed=True so it can skip optional work like autoreplies. Once max_queued events are waiting, new
+events are dropped outright.'''
+
+WORKERS = 8
+MAX_QUEUED = 500
+SHED_DEPTH = 100
+_SMOOTHING = 0.1  # Weight of the newest sample in the moving averages.
+
+
+class InboundQueue(object):
+    """Bounded, per-conversation ordered work queue for handler(item, shed) coroutines."""
+
+    def __init__(self, handler, workers=WORKERS, max_queued=MAX_QUEUED, shed_depth=SHED_DEPTH):
+        self.handler = handler
+        self.workers = workers
+        self.max_queued = max_queued
+        self.shed_depth = shed_depth
+        self.depth = 0
+        self._pending = {}  # conv_id -> deque of (time queued, item, sheddable), while queued or being handled.
+        self._ready = None  # Queue of conv_ids with events waiting and no worker on them.
+        self._tasks = []
+
+        self.max_depth = 0
+        self.processed = 0
+        self.dropped = 0
+        self.shed = 0
+        self.average_wait = 0.0
+        self.max_wait = 0.0
+        self.average_handle_time = 0.0
+
+    def put(self, conv_id, item, sheddable=False):
+        """Queues item for conv_id. Returns False if the queue is full and it was dropped."""
+        if self.depth >= self.max_queued:
+            self.dropped += 1
+            return False
+        self._start()
+        pending = self._pending.get(conv_id)
+        if pending is None:
+            pending = self._pending[conv_id] = deque()
+            self._ready.put_nowait(conv_id)
+        pending.append((asyncio.get_event_loop().time(), item, sheddable))
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        return True
+
+    def _start(self):
+        if self._ready is None:
+            self._ready = asyncio.Queue()
+            self._tasks = [asyncio.async(self._work()) for _ in range(self.workers)]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._ready = None
+        self._pending.clear()
+        self.depth = 0
+
+    @asyncio.coroutine
+    def _work(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            conv_id = yield from self._ready.get()
+            pending = self._pending[conv_id]
+            queued_at, item, sheddable = pending.popleft()
+            shed = sheddable and self.depth > self.shed_depth
+            self.depth -= 1
+            if shed:
+                self.shed += 1
+
+            started = loop.time()
+            wait = started - queued_at
+            self.average_wait += (wait - self.average_wait) * _SMOOTHING
+            self.max_wait = max(self.max_wait, wait)
+            try:
+                yield from self.handler(item, shed)
+            except Exception:
+                traceback.print_exc()
+            self.average_handle_time += (loop.time() - started - self.average_handle_time) * _SMOOTHING
+            self.processed += 1
+
+            if pending:
+                self._ready.put_nowait(conv_id)
+            else:
+                del self._pending[conv_id]
+
+    def stats(self):
+        return {
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'shed': self.shed,
+            'average_wait': self.average_wait,
+            'max_wait': self.max_wait,
+            'average_handle_time': self.average_handle_time,
+        }
@@ -0,0 +1,43 @@
+import importlib
+import sys
+import time
+import types
+
+''' Defers importing heavy modules until they're first used, so starting the bot (and importing every command module)
+doesn't pay for libraries that only a few commands need.
+
+    parser = lazy_import('dateutil.parser')
+
+gives a stand-in module; the real one is imported the first time one of its attributes is looked up, after which the
+stand-in behaves like it. import_times records how long each deferred import took (see Benchmarks/bench_startup.py).'''
+
+import_times = {}  # Module name -> seconds its (deferred) import took.
+
+
+class LazyModule(types.ModuleType):
+    """Stand-in for a module that's imported on first attribute access."""
+
+    def _load(self):
+        name = self.__name__
+        module = sys.modules.get(name)
+        if module is None or module is self:
+            start = time.perf_counter()
+            module = importlib.import_module(name)
+            import_times[name] = time.perf_counter() - start
+        self.__dict__.update(module.__dict__)
+        return module
+
+    def __getattr__(self, attribute):
+        # Only called for attributes the stand-in doesn't have yet, i.e. before the module is loaded.
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        return '<lazy module {!r}>'.format(self.__name__)
+
+
+def lazy_import(name):
+    """Returns name's module if it's already imported, otherwise a LazyModule for it."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
@@ -0,0 +1,158 @@
+''' Levenshtein distances for matching one query (like a /finish lyric) against many lines.
+
+Two ways of computing a distance, both exact:
+
+- Myers' bit-parallel algorithm, for queries up to MYERS_MAX_LENGTH characters. A column of the edit distance table is
+  kept as the bits of two integers, so each character of the line costs a handful of integer operations instead of a
+  loop over the query. Python integers have no fixed width, so this works for any length, just more slowly as they
+  grow; even so it beats the table by far at any length a chat message reaches (see Benchmarks/bench_levenshtein.py).
+- The usual dynamic programming table, keeping only the previous and the current row, for longer queries.
+
+Both take a bound and give up as soon as the distance is known to be more than it, returning bound + 1. Scoring many
+lines with best_match passes the best distance found so far as the bound, so most lines are rejected after a few
+characters (or, when their length alone is too different, without looking at them at all).
+
+Lines are compared the way UtilBot.levenshtein_distance always has: a line longer than the query is cut to the query's
+length first, and reported as chopped.'''
+
+MYERS_MAX_LENGTH = 1024
+
+
+def _trim(first, second):
+    """Drops the prefix and suffix first and second have in common, which doesn't change their distance."""
+    start = 0
+    end = min(len(first), len(second))
+    while start < end and first[start] == second[start]:
+        start += 1
+    first_end, second_end = len(first), len(second)
+    while first_end > start and second_end > start and first[first_end - 1] == second[second_end - 1]:
+        first_end -= 1
+        second_end -= 1
+    return first[start:first_end], second[start:second_end]
+
+
+def _table_distance(first, second, bound):
+    """Two-row dynamic programming, stopping once a whole row is over bound."""
+    if len(first) < len(second):
+        first, second = second, first
+    previous = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, 1):
+        current = [i]
+        for j, second_char in enumerate(second, 1):
+            cost = previous[j - 1] + (first_char != second_char)
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            current.append(cost)
+        if min(current) > bound:
+            return bound + 1
+        previous = current
+    return min(previous[-1], bound + 1)
+
+
+def _pattern_masks(pattern):
+    """Character -> bit mask of the positions it's at in pattern."""
+    masks = {}
+    for i, char in enumerate(pattern):
+        masks[char] = masks.get(char, 0) | (1 << i)
+    return masks
+
+
+def _myers_distance(masks, length, text, bound):
+    """Myers' bit-parallel distance between the pattern masks were made from (of length characters) and text."""
+    if not length:
+        return len(text)
+    full = (1 << length) - 1
+    last = 1 << (length - 1)
+    vertical_plus, vertical_minus = full, 0
+    score = length
+    remaining = len(text)
+    for char in text:
+        equal = masks.get(char, 0)
+        vertical_x = equal | vertical_minus
+        horizontal_x = ((((equal & vertical_plus) + vertical_plus) & full) ^ vertical_plus) | equal
+        horizontal_plus = vertical_minus | (~(horizontal_x | vertical_plus) & full)
+        horizontal_minus = vertical_plus & horizontal_x
+        if horizontal_plus & last:
+            score += 1
+        elif horizontal_minus & last:
+            score -= 1
+        remaining -= 1
+        # Each character left can lower the score by at most one.
+        if score - remaining > bound:
+            return bound + 1
+        horizontal_plus = ((horizontal_plus << 1) | 1) & full
+        horizontal_minus = (horizontal_minus << 1) & full
+        vertical_plus = horizontal_minus | (~(vertical_x | horizontal_plus) & full)
+        vertical_minus = horizontal_plus & vertical_x
+    return score
+
+
+def distance(first, second, bound=None):
+    """The Levenshtein distance between first and second, or bound + 1 if it's more than bound."""
+    if bound is None:
+        bound = max(len(first), len(second))
+    if abs(len(first) - len(second)) > bound:
+        return bound + 1
+    first, second = _trim(first, second)
+    if len(first) > len(second):
+        first, second = second, first
+    if not first:
+        return len(second)
+    if len(first) <= MYERS_MAX_LENGTH:
+        return _myers_distance(_pattern_masks(first), len(first), second, bound)
+    return _table_distance(first, second, bound)
+
+
+class Matcher(object):
+    """Scores lines against one query, reusing the work that only depends on the query."""
+
+    def __init__(self, query):
+        self.query = query
+        self._masks = _pattern_masks(query) if len(query) <= MYERS_MAX_LENGTH else None
+
+    def distance(self, text, bound=None):
+        """The distance between the query and text, or bound + 1 if it's more than bound."""
+        if bound is None:
+            bound = max(len(self.query), len(text))
+        if abs(len(self.query) - len(text)) > bound:
+            return bound + 1
+        if self._masks is None:
+            return distance(self.query, text, bound)
+        return _myers_distance(self._masks, len(self.query), text, bound)
+
+    def score(self, line, bound=None):
+        """(distance, chopped) for line, like UtilBot.levenshtein_distance(line, query)."""
+        chopped = len(line) > len(self.query)
+        if chopped:
+            line = line[:len(self.query)]
+        return self.distance(line, bound), chopped
+
+    def score_all(self, lines, bound=None):
+        """A (distance, chopped) pair for every line. Distances over bound are given as bound + 1."""
+        return [self.score(line, bound) for line in lines]
+
+    def best_match(self, lines):
+        """(index, distance, chopped) of the first of lines closest to the query, or None if there are no lines."""
+        best = None
+        for index, line in enumerate(lines):
+            if best is None:
+                dist, chopped = self.score(line)
+            else:
+                # Only a strictly closer line can replace the best one.
+                dist, chopped = self.score(line, best[1] - 1)
+                if dist >= best[1]:
+                    continue
+            best = index, dist, chopped
+            if dist == 0:
+                break
+        return best
+
+
+def score_all(query, lines, bound=None):
+    return Matcher(query).score_all(lines, bound)
+
+
+def best_match(query, lines):
+    return Matcher(query).best_match(lines)
@@ -0,0 +1,106 @@
+import asyncio
+from urllib import parse
+
+from Core.Util import UtilHTTP
+from Core.Util.ResultCache import ResultCache, exact_args
+
+''' Summarizes pasted links for the hidden _url_handle command.
+
+Summaries are cached by canonical URL, so the same link pasted into several (forwarded) conversations is only fetched
+and summarized once. Concurrent requests for a URL that's already being summarized wait on the same job instead of
+starting another one (single-flight), and the CPU-heavy BeautifulSoup/NLTK work runs in a summarize.SummarizePool of
+worker processes so it doesn't hold up the event loop.'''
+
+PREVIEW_TTL = 6 * 60 * 60
+MAX_PREVIEWS = 256
+WORKERS = 2
+MAX_PENDING = 8
+SUMMARIZE_TIMEOUT = 30
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def canonicalize_url(url):
+    """Normalizes a URL so trivially different spellings of the same page share a cache entry."""
+    if not url.startswith("http://") and not url.startswith("https://"):
+        url = "http://" + url
+    parts = parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or '').lower()
+    if parts.port and parts.port != _DEFAULT_PORTS.get(scheme):
+        netloc += ':{}'.format(parts.port)
+    query = [(key, value) for key, value in parse.parse_qsl(parts.query, keep_blank_values=True)
+             if not key.startswith('utm_')]
+    return parse.urlunsplit((scheme, netloc, parts.path or '/', parse.urlencode(query), ''))
+
+
+class PreviewUnavailableError(Exception):
+    """Raised when the summarizer is too busy, or took too long, to preview a page."""
+
+
+class LinkPreviewer(object):
+    """Fetches and summarizes pages, with a TTL cache and single-flight deduplication."""
+
+    def __init__(self, ttl=PREVIEW_TTL, max_entries=MAX_PREVIEWS, workers=WORKERS, max_pending=MAX_PENDING,
+                 timeout=SUMMARIZE_TIMEOUT):
+        # Keyed on the exact canonical URL: paths and queries are case sensitive.
+        self._cache = ResultCache(max_entries=max_entries, default_ttl=ttl, key=exact_args)
+        self._in_flight = {}  # Canonical URL -> task summarizing it.
+        self._pool_options = {'max_workers': workers, 'max_pending': max_pending, 'timeout': timeout}
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            from Libraries import summarize
+            self._pool = summarize.SummarizePool(**self._pool_options)
+        return self._pool
+
+    @asyncio.coroutine
+    def get_summary(self, url):
+        """Returns the summarize.Summary of the page at url. Raises HTTPError/URLError if it couldn't be fetched, and
+        PreviewUnavailableError if it couldn't be summarized in time."""
+        canonical = canonicalize_url(url)
+        summary = self._cache.get('preview', [canonical])
+        if summary is not None:
+            self._cache.hits += 1
+            return summary
+
+        task = self._in_flight.get(canonical)
+        if task is None:
+            self._cache.misses += 1
+            task = asyncio.get_event_loop().create_task(self._summarize(url, canonical))
+            self._in_flight[canonical] = task
+            task.add_done_callback(lambda t: self._in_flight.pop(canonical, None))
+        # Shielded so one caller giving up doesn't cancel the job for everyone else waiting on it.
+        return (yield from asyncio.shield(task))
+
+    @asyncio.coroutine
+    def _summarize(self, url, canonical):
+        """Summarizes url as posted (canonicalizing re-encodes the query and drops parts of it, so it's only used as
+        the key) and caches the summary under canonical."""
+        from Libraries import summarize
+
+        html = yield from UtilHTTP.fetch_text(url)
+        try:
+            summary = yield from self._get_pool().summarize_html(url, html)
+        except (summarize.SummarizeBusyError, summarize.SummarizeTimeoutError) as e:
+            # So callers can catch this without importing the summarizer themselves.
+            raise PreviewUnavailableError(str(e))
+        # Don't keep the whole article alive in the cache.
+        summary = summarize.Summary(summary.url, None, summary.title, summary.summaries)
+        self._cache.set('preview', [canonical], summary)
+        return summary
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats['in_flight'] = len(self._in_flight)
+        return stats
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+
+# Shared previewer used by _url_handle.
+LinkPreviewSingleton = LinkPreviewer()
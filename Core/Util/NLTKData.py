@@ -0,0 +1,190 @@
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import time
+
+''' Makes sure the NLTK data the URL summarizer needs (stopwords and punkt) is available, without touching the network
+unless asked to.
+
+The data lives in DATA_DIR (nltk_data in the project root), next to a manifest recording, for every file of every
+package, its size, modification time and SHA-256. On start each package is checked against the manifest: files whose
+size and modification time still match are trusted, and anything else is re-hashed. Data NLTK can already find
+elsewhere (like a system-wide install) counts too. Missing or damaged packages are only downloaded when ensure is called
+with refresh=True (python Main.py --refresh-nltk-data); otherwise they're reported, and the summarizer is disabled.
+
+When everything checks out, NLTK itself isn't even imported: the data directory is handed to it through the NLTK_DATA
+environment variable, which it reads when something imports it later (including the summarizer's worker processes).
+
+Call ensure once at startup (Main.py does); is_ready tells the commands whether they can use NLTK.'''
+
+DATA_DIR = 'nltk_data'
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+# Package -> where its data lives, relative to a NLTK data directory.
+PACKAGES = {
+    'stopwords': 'corpora/stopwords',
+    'punkt': 'tokenizers/punkt',
+}
+
+_status = None  # Package -> 'ok', 'missing', 'corrupt' or 'no nltk', once checked.
+
+
+def _manifest_path(data_dir):
+    return os.path.join(data_dir, MANIFEST_NAME)
+
+
+def _load_manifest(data_dir):
+    try:
+        with open(_manifest_path(data_dir), encoding='utf-8') as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return {'version': MANIFEST_VERSION, 'packages': {}}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {'version': MANIFEST_VERSION, 'packages': {}}
+    return manifest
+
+
+def _save_manifest(data_dir, manifest):
+    path = _manifest_path(data_dir)
+    with open(path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _package_files(data_dir, resource):
+    """Relative paths of the files making up a package: its directory's contents and its zip, if there is one."""
+    files = []
+    root = os.path.join(data_dir, *resource.split('/'))
+    if os.path.isfile(root + '.zip'):
+        files.append(resource + '.zip')
+    for directory, _, names in os.walk(root):
+        for name in names:
+            files.append(os.path.relpath(os.path.join(directory, name), data_dir).replace(os.sep, '/'))
+    return sorted(files)
+
+
+def _describe(data_dir, relative_path):
+    path = os.path.join(data_dir, *relative_path.split('/'))
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': _sha256(path)}
+
+
+def _verify(data_dir, entry):
+    """Checks a package's files against its manifest entry. Returns (ok, whether the entry's stats were refreshed)."""
+    refreshed = False
+    for relative_path, expected in entry['files'].items():
+        path = os.path.join(data_dir, *relative_path.split('/'))
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False, refreshed
+        if stat.st_size == expected['size'] and stat.st_mtime_ns == expected['mtime']:
+            continue
+        if stat.st_size != expected['size'] or _sha256(path) != expected['sha256']:
+            return False, refreshed
+        expected['mtime'] = stat.st_mtime_ns  # Touched, but the same data.
+        refreshed = True
+    return bool(entry['files']), refreshed
+
+
+def _record(data_dir, manifest, package, nltk_version):
+    files = _package_files(data_dir, PACKAGES[package])
+    manifest['packages'][package] = {
+        'nltk_version': nltk_version,
+        'recorded': int(time.time()),
+        'files': {relative_path: _describe(data_dir, relative_path) for relative_path in files},
+    }
+    return bool(files)
+
+
+def _add_data_path(data_dir):
+    nltk = sys.modules.get('nltk')
+    if nltk is not None:
+        if data_dir not in nltk.data.path:
+            nltk.data.path.append(data_dir)
+        return
+    paths = [path for path in os.environ.get('NLTK_DATA', '').split(os.pathsep) if path]
+    if data_dir not in paths:
+        os.environ['NLTK_DATA'] = os.pathsep.join(paths + [data_dir])
+
+
+def _nltk_version():
+    import nltk
+    return nltk.__version__
+
+
+def _found_elsewhere(resource):
+    import nltk
+    try:
+        nltk.data.find(resource)
+        return True
+    except LookupError:
+        return False
+
+
+def ensure(refresh=False, data_dir=DATA_DIR):
+    """Checks (and with refresh, downloads) the NLTK data. Returns a dict of package -> status."""
+    global _status
+    if importlib.util.find_spec('nltk') is None:
+        _status = {package: 'no nltk' for package in PACKAGES}
+        return _status
+
+    data_dir = os.path.abspath(data_dir)
+    _add_data_path(data_dir)
+    manifest = _load_manifest(data_dir)
+    changed = False
+    status = {}
+    for package, resource in sorted(PACKAGES.items()):
+        entry = manifest['packages'].get(package)
+        if entry is not None:
+            ok, refreshed = _verify(data_dir, entry)
+            changed = changed or refreshed
+            state = 'ok' if ok else 'corrupt'
+        elif _package_files(data_dir, resource):
+            # Installed here before there was a manifest (or by hand); trust it from now on.
+            _record(data_dir, manifest, package, _nltk_version())
+            changed = True
+            state = 'ok'
+        elif _found_elsewhere(resource):
+            state = 'ok'
+        else:
+            state = 'missing'
+
+        if state != 'ok' and refresh:
+            print('Downloading NLTK package {} to {}...'.format(package, data_dir))
+            os.makedirs(data_dir, exist_ok=True)
+            import nltk
+            if nltk.download(package, download_dir=data_dir, quiet=True, force=state == 'corrupt',
+                             raise_on_error=False) and \
+                    _record(data_dir, manifest, package, nltk.__version__):
+                changed = True
+                state = 'ok'
+        if state != 'ok':
+            print('NLTK package {} is {}.{}'.format(package, state, ' Download failed.' if refresh else
+                                                    ' Run with --refresh-nltk-data to download it.'))
+        status[package] = state
+
+    if changed:
+        try:
+            _save_manifest(data_dir, manifest)
+        except OSError as e:
+            print('Could not save the NLTK data manifest: {}'.format(e))
+    _status = status
+    return status
+
+
+def is_ready():
+    """Whether NLTK and all of its data are available. Checks (offline) if ensure hasn't been called yet."""
+    status = _status if _status is not None else ensure()
+    return all(state == 'ok' for state in status.values())
@@ -0,0 +1,138 @@
+import asyncio
+from collections import deque
+import traceback
+
+import hangups
+
+''' Sends the bot's messages. Each conversation gets its own ordered queue, drained by a task that only exists while
+there's something to send, and every send (including retries) takes a token from a bucket shared by all conversations,
+so a burst of replies is smoothed out instead of hitting Hangouts all at once.
+
+Small text messages queued for the same conversation within COALESCE_WINDOW of each other are merged into one message
+(separated by line breaks). Sends that fail with hangups.NetworkError are retried with exponential backoff.'''
+
+RATE = 3.0  # Messages per second, on average.
+BURST = 10  # Messages that can be sent back to back after a quiet spell.
+COALESCE_WINDOW = 0.1
+MAX_COALESCED_LENGTH = 1000  # Characters of text a merged message may hold.
+MAX_QUEUED = 100  # Per conversation; messages beyond this are dropped.
+MAX_RETRIES = 3
+RETRY_DELAY = 1.0
+
+
+def _text_length(segments):
+    return sum(len(segment.text or '') for segment in segments)
+
+
+class TokenBucket(object):
+    """Allows rate acquisitions per second on average, and up to capacity at once."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = None
+
+    @asyncio.coroutine
+    def acquire(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            now = loop.time()
+            if self._updated is not None:
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            yield from asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class _Message(object):
+    def __init__(self, segments, image_id, future):
+        self.segments = segments
+        self.image_id = image_id
+        self.future = future
+
+
+class OutboundQueue(object):
+    """Per-conversation, rate limited, coalescing message sender."""
+
+    def __init__(self, rate=RATE, burst=BURST, coalesce_window=COALESCE_WINDOW,
+                 max_coalesced_length=MAX_COALESCED_LENGTH, max_queued=MAX_QUEUED, max_retries=MAX_RETRIES,
+                 retry_delay=RETRY_DELAY):
+        self.bucket = TokenBucket(rate, burst)
+        self.coalesce_window = coalesce_window
+        self.max_coalesced_length = max_coalesced_length
+        self.max_queued = max_queued
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._queues = {}  # conv_id -> deque of _Message
+        self._workers = {}  # conv_id -> task draining that queue
+
+    def send(self, conversation, segments, image_id=None):
+        """Queues a message. Returns a future that resolves to True once it's sent, or False if it was dropped or
+        couldn't be sent."""
+        future = asyncio.Future()
+        conv_id = conversation.id_
+        queue = self._queues.setdefault(conv_id, deque())
+        if len(queue) >= self.max_queued:
+            print('Dropping message to {}: {} messages already queued'.format(conv_id, len(queue)))
+            future.set_result(False)
+            return future
+        queue.append(_Message(list(segments), image_id, future))
+        if conv_id not in self._workers:
+            self._workers[conv_id] = asyncio.async(self._drain(conv_id, conversation, queue))
+        return future
+
+    def _next_batch(self, queue):
+        """Takes the next message off of queue, along with any small text messages right behind it."""
+        batch = [queue.popleft()]
+        if batch[0].image_id is not None:
+            return batch
+        length = _text_length(batch[0].segments)
+        while queue and queue[0].image_id is None:
+            length += _text_length(queue[0].segments)
+            if length > self.max_coalesced_length:
+                break
+            batch.append(queue.popleft())
+        return batch
+
+    @asyncio.coroutine
+    def _drain(self, conv_id, conversation, queue):
+        try:
+            while queue:
+                if len(queue) == 1 and queue[0].image_id is None and self.coalesce_window and \
+                        _text_length(queue[0].segments) < self.max_coalesced_length:
+                    # Give whatever else is being said a moment to arrive.
+                    yield from asyncio.sleep(self.coalesce_window)
+                batch = self._next_batch(queue)
+                segments = list(batch[0].segments)
+                for message in batch[1:]:
+                    segments.append(hangups.ChatMessageSegment('\n', hangups.SegmentType.LINE_BREAK))
+                    segments.extend(message.segments)
+                sent = yield from self._send(conversation, segments, batch[0].image_id)
+                for message in batch:
+                    if not message.future.done():
+                        message.future.set_result(sent)
+        finally:
+            del self._workers[conv_id]
+            if not queue:
+                self._queues.pop(conv_id, None)
+
+    @asyncio.coroutine
+    def _send(self, conversation, segments, image_id):
+        for attempt in range(self.max_retries + 1):
+            yield from self.bucket.acquire()
+            try:
+                yield from conversation.send_message(segments, image_id=image_id)
+                return True
+            except hangups.NetworkError as e:
+                if attempt < self.max_retries:
+                    delay = self.retry_delay * 2 ** attempt
+                    print('Failed to send message ({}), retrying in {} seconds'.format(e, delay))
+                    yield from asyncio.sleep(delay)
+            except Exception:
+                traceback.print_exc()
+                break
+        print('Failed to send message!')
+        return False
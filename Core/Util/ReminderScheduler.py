@@ -0,0 +1,82 @@
+import asyncio
+import heapq
+import itertools
+import time
+import traceback
+
+''' Fires reminders on the event loop. Pending reminders sit in a min-heap ordered by due time, and a single loop timer
+is kept armed for the earliest one, so any number of reminders costs one timer instead of a thread each.
+
+Cancelled reminders are only forgotten, and their heap entries are dropped once they reach the top.'''
+
+
+class ReminderScheduler(object):
+    """Calls the coroutine function callback(reminder_id, conv_id, message) when each reminder is due."""
+
+    def __init__(self, callback, loop=None):
+        self.callback = callback
+        self.loop = loop or asyncio.get_event_loop()
+        self._heap = []  # (due unix time, sequence number, reminder_id, conv_id, message)
+        self._scheduled = {}  # reminder_id -> sequence number of its live heap entry.
+        self._sequence = itertools.count()
+        self._timer = None
+        self._timer_due = None
+
+    def __len__(self):
+        return len(self._scheduled)
+
+    def add(self, reminder_id, conv_id, message, due):
+        """Schedules a reminder, replacing any scheduled with the same id. due is a datetime (naive, local time) or a
+        unix timestamp."""
+        if not isinstance(due, (int, float)):
+            due = time.mktime(due.timetuple()) + due.microsecond / 1e6
+        sequence = next(self._sequence)
+        self._scheduled[reminder_id] = sequence
+        heapq.heappush(self._heap, (due, sequence, reminder_id, conv_id, message))
+        self._arm()
+
+    def cancel(self, reminder_id):
+        if self._scheduled.pop(reminder_id, None) is not None:
+            self._arm()
+
+    def clear(self):
+        self._heap = []
+        self._scheduled.clear()
+        self._arm()
+
+    def _is_live(self, entry):
+        return self._scheduled.get(entry[2]) == entry[1]
+
+    def _arm(self):
+        """Points the loop timer at the earliest live reminder."""
+        while self._heap and not self._is_live(self._heap[0]):
+            heapq.heappop(self._heap)
+        due = self._heap[0][0] if self._heap else None
+        if due == self._timer_due:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._timer_due = due
+        if due is not None:
+            self._timer = self.loop.call_at(self.loop.time() + max(0, due - time.time()), self._fire)
+
+    def _fire(self):
+        self._timer = None
+        self._timer_due = None
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if not self._is_live(entry):
+                continue
+            due, sequence, reminder_id, conv_id, message = entry
+            del self._scheduled[reminder_id]
+            self.loop.create_task(self._run(reminder_id, conv_id, message))
+        self._arm()
+
+    @asyncio.coroutine
+    def _run(self, reminder_id, conv_id, message):
+        try:
+            yield from self.callback(reminder_id, conv_id, message)
+        except Exception:
+            traceback.print_exc()
@@ -0,0 +1,133 @@
+import asyncio
+from collections import OrderedDict
+import json
+import time
+
+from Core.Util import AsyncDB
+
+''' Caches the results of lookup commands (/define, /wiki, /udefine, /quote, /finish, /goog), keyed on the command name
+and its normalized arguments, so a repeated query doesn't go back out to the network.
+
+Entries expire after a per-command TTL and the least recently used entry is evicted once the cache is full. With
+persistent=True, results that can be stored as JSON are also written to the result_cache table in the database, so they
+survive restarts.'''
+
+DEFAULT_TTLS = {
+    'define': 24 * 60 * 60,
+    'wiki': 24 * 60 * 60,
+    'udefine': 24 * 60 * 60,
+    'quote': 24 * 60 * 60,
+    'finish': 24 * 60 * 60,
+    'goog': 60 * 60,
+}
+
+
+def normalize_args(args):
+    """Case and whitespace insensitive key for a command's arguments."""
+    return ' '.join(' '.join(str(arg) for arg in args).lower().split())
+
+
+def exact_args(args):
+    """Key for arguments that differ whenever their text does, like URLs."""
+    return '\n'.join(str(arg) for arg in args)
+
+
+class ResultCache(object):
+    """TTL + LRU cache of command results. key turns a command's arguments into the key they're cached under."""
+
+    def __init__(self, max_entries=1024, default_ttl=60 * 60, ttls=None, persistent=False, key=normalize_args):
+        self.max_entries = max_entries
+        self.key = key
+        self.default_ttl = default_ttl
+        self.ttls = dict(ttls or {})
+        self.persistent = persistent
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (command, key) -> (expires, value), least recently used first.
+
+    def get_ttl(self, command):
+        return self.ttls.get(command, self.default_ttl)
+
+    def get(self, command, args):
+        """Returns the cached result, or None if there isn't a fresh one in memory."""
+        entry_key = (command, self.key(args))
+        try:
+            expires, value = self._entries[entry_key]
+        except KeyError:
+            return None
+        if expires <= time.time():
+            del self._entries[entry_key]
+            return None
+        self._entries.move_to_end(entry_key)
+        return value
+
+    def set(self, command, args, value, ttl=None):
+        ttl = self.get_ttl(command) if ttl is None else ttl
+        if value is None or ttl <= 0:
+            return
+        entry_key = (command, self.key(args))
+        self._entries[entry_key] = (time.time() + ttl, value)
+        self._entries.move_to_end(entry_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, command=None):
+        if command is None:
+            self._entries.clear()
+        else:
+            for entry_key in [k for k in self._entries if k[0] == command]:
+                del self._entries[entry_key]
+
+    @asyncio.coroutine
+    def get_or_fetch(self, command, args, fetch, ttl=None):
+        """Returns the cached result for command/args, or runs the coroutine function fetch() and caches what it
+        returns. None results are never cached."""
+        value = self.get(command, args)
+        if value is None and self.persistent:
+            value = yield from self._load(command, args)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = yield from fetch()
+        self.set(command, args, value, ttl)
+        if value is not None and self.persistent:
+            yield from self._store(command, args, value, ttl)
+        return value
+
+    @asyncio.coroutine
+    def _load(self, command, args):
+        row = yield from AsyncDB.fetchone("SELECT value, expires FROM result_cache WHERE command = ? AND key = ?",
+                                          (command, self.key(args)))
+        if row is None or row[1] <= time.time():
+            return None
+        value = json.loads(row[0])
+        # Keep it in memory for the rest of its lifetime.
+        self.set(command, args, value, row[1] - time.time())
+        return value
+
+    @asyncio.coroutine
+    def _store(self, command, args, value, ttl=None):
+        ttl = self.get_ttl(command) if ttl is None else ttl
+        try:
+            serialized = json.dumps(value)
+        except (TypeError, ValueError):
+            return
+        now = time.time()
+        yield from AsyncDB.execute("INSERT OR REPLACE INTO result_cache VALUES (?, ?, ?, ?)",
+                                   (command, self.key(args), serialized, now + ttl))
+        yield from AsyncDB.execute("DELETE FROM result_cache WHERE expires <= ?", (now,))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / total if total else 0.0,
+        }
+
+
+# Shared cache used by the lookup commands.
+CommandCache = ResultCache(ttls=DEFAULT_TTLS, persistent=True)
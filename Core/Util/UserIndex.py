@@ -0,0 +1,55 @@
+from bisect import bisect_left
+
+''' Finds the users in a conversation whose names match what someone typed (like an @mention), without sorting and
+scanning every user in the conversation each time.
+
+A conversation's users are sorted once (by last name, then full name, then id, so ties always come out the same way),
+and every word of their names goes into a sorted list, so the users with a word starting with the query are found with
+a bisect. Matches are ordered: an exact full name first, then names with a word starting with the query, then (only if
+there were none of those) names containing it anywhere, as the commands used to match. The bot keeps one index per
+conversation and drops it when people join or leave.'''
+
+
+def _normalize(name):
+    return ' '.join(name.lower().split())
+
+
+def _sort_key(user):
+    name = _normalize(user.full_name)
+    return name.rsplit(' ', 1)[-1], name, user.id_.chat_id
+
+
+class UserIndex(object):
+    def __init__(self, users):
+        self.users = tuple(sorted(users, key=_sort_key))  # Sorted by last name.
+        self._names = [_normalize(user.full_name) for user in self.users]
+        self._words = sorted((word, position) for position, name in enumerate(self._names) for word in name.split())
+
+    def __len__(self):
+        return len(self.users)
+
+    def find(self, query):
+        """Returns the users matching query, best matches first."""
+        query = _normalize(query)
+        if not query:
+            return []
+
+        first_word = query.split(' ', 1)[0]
+        positions = set()
+        for word, position in self._words[bisect_left(self._words, (first_word,)):]:
+            if not word.startswith(first_word):
+                break
+            positions.add(position)
+        if ' ' in query:
+            # Keep the names where the whole query starts at the start of a word.
+            positions = [position for position in positions if (' ' + query) in (' ' + self._names[position])]
+        if positions:
+            positions = sorted(positions, key=lambda position: (self._names[position] != query, position))
+        else:
+            positions = [position for position, name in enumerate(self._names) if query in name]
+        return [self.users[position] for position in positions]
+
+    def find_one(self, query):
+        """Returns the best match for query, or None."""
+        matches = self.find(query)
+        return matches[0] if matches else None
@@ -1,21 +1,31 @@
+import asyncio
 from bisect import bisect_left
-from datetime import datetime, timedelta
 import os
-from urllib import request
-from bs4 import BeautifulSoup, Tag
+from urllib import parse
+from urllib.error import HTTPError, URLError
 import re
 import hangups
-import sqlite3
-from Core.Util import UtilDB
+from Core.Util import UtilDB, UtilHTTP, CommandIndex, Levenshtein
+from Core.Util.LazyImport import lazy_import
+from Core.Util.HashtagSegmenter import HashtagSegmenter, find_hashtags
+from Core.Util.WordIndex import WordIndex
+
+bs4 = lazy_import('bs4')
 
 __author__ = 'wardellchandler'
 
 # TODO I think this is a relic of Bots Past. Check into whether it's needed.
-words = open("Core" + os.sep + "Util" + os.sep + "wordlist.txt")
-word_list = []
-for line in words:
-    word_list.append(line.strip('\n'))
-word_list.sort()
+# Opened by get_word_index the first time it's needed.
+word_index = None
+hashtag_segmenter = None
+
+
+def get_word_index():
+    """Returns the WordIndex of Core/Util/wordlist.txt (plus any words added since)."""
+    global word_index
+    if word_index is None:
+        word_index = WordIndex("Core" + os.sep + "Util" + os.sep + "wordlist.txt")
+    return word_index
 
 # Blocklist
 _blocklist = {}
@@ -77,23 +87,8 @@ def is_user_admin(bot, user_info, conv_id=None):
 
 
 def check_if_can_run_command(bot, event, command):
-    commands_admin_list = bot.get_config_suboption(event.conv_id, 'commands_admin')
-    commands_conv_admin_list = bot.get_config_suboption(event.conv_id, 'commands_conversation_admin')
-    admins_list = bot.get_config_suboption(event.conv_id, 'admins')
-    conv_admin = bot.get_config_suboption(event.conv_id, 'conversation_admin')
-
-
-    # Check if this is a conversation admin command.
-    if commands_conv_admin_list and (command in commands_conv_admin_list):
-        if (admins_list and event.user_id[0] not in admins_list) \
-                and (conv_admin and event.user_id[0] != conv_admin):
-            return False
-
-    # Check if this is a admin-only command.
-    if commands_admin_list and (command in commands_admin_list):
-        if not admins_list or event.user_id[0] not in admins_list:
-            return False
-    return True
+    conv_config = bot.get_conv_config(event.conv_id)
+    return CommandIndex.can_run(conv_config, CommandIndex.access(conv_config, event.user_id[0]), command)
 
 
 def get_vote_subject(conv_id):
@@ -245,51 +240,41 @@ def check(string):
     return string.replace("&#39", "'")
 
 
-def define(word, num=1):
+@asyncio.coroutine
+def get_definitions(word):
+    """Returns every WordNet definition of word, or None if they couldn't be downloaded."""
+    url = "http://wordnetweb.princeton.edu/perl/webwn?s=" + parse.quote(word) + "&sub=Search+WordNet&o2=&o0=&o8=1&o1=1&o7=&o5=&o9=&o6=&o3=&o4=&h=0000000000"
+    try:
+        soup = yield from UtilHTTP.fetch_soup(url)
+    except (HTTPError, URLError):
+        return None
+    if soup.ul is None:
+        return []
+    return [x.text for x in list(soup.ul) if isinstance(x, bs4.Tag) and x.text != '\n' and x.text != '']
+
+
+def format_definition(definitions, num=1):
+    """Picks definition number num out of get_definitions' result, in the form (definition, number of definitions)."""
     if num < 1:
         num = 1
-    try:
-        url = "http://wordnetweb.princeton.edu/perl/webwn?s=" + word + "&sub=Search+WordNet&o2=&o0=&o8=1&o1=1&o7=&o5=&o9=&o6=&o3=&o4=&h=0000000000"
-    except Exception as e:
-        print(e)
-        return 'Couldn\'t download definition.'
-    try:
-        soup = BeautifulSoup(request.urlopen(url))
-    except:
+    if definitions is None:
         return "Network Error: Couldn't download definition.", 0
-    if soup.ul is not None:
-        definitions = [x.text for x in list(soup.ul) if isinstance(x, Tag) and x.text != '\n' and x.text != '']
-        if len(definitions) >= num:
-            return (definitions[num - 1] + '[' + str(num) + ' of ' + str(len(definitions)) + ']')[
-                   3:].capitalize(), len(definitions)
+    if len(definitions) >= num:
+        return (definitions[num - 1] + '[' + str(num) + ' of ' + str(len(definitions)) + ']')[
+               3:].capitalize(), len(definitions)
     return "Couldn\'t find definition.", 0
 
 
+@asyncio.coroutine
+def define(word, num=1):
+    definitions = yield from get_definitions(word)
+    return format_definition(definitions, num)
+
+
 def levenshtein_distance(first, second):
-    """Find the Levenshtein distance between two strings."""
-    chopped = False
-    if len(first) > len(second):
-        first = first[:len(second)]
-        first, second = second, first
-        chopped = True
-    if len(second) == 0:
-        return len(first)
-    first_length = len(first) + 1
-    second_length = len(second) + 1
-    distance_matrix = [[0] * second_length for x in range(first_length)]
-    for i in range(first_length):
-        distance_matrix[i][0] = i
-    for j in range(second_length):
-        distance_matrix[0][j] = j
-    for i in range(1, first_length):
-        for j in range(1, second_length):
-            deletion = distance_matrix[i - 1][j] + 1
-            insertion = distance_matrix[i][j - 1] + 1
-            substitution = distance_matrix[i - 1][j - 1]
-            if first[i - 1] != second[j - 1]:
-                substitution += 1
-            distance_matrix[i][j] = min(insertion, deletion, substitution)
-    return distance_matrix[first_length - 1][second_length - 1], chopped
+    """Find the Levenshtein distance between two strings. If first is longer than second, only as much of it as second
+    is long is compared. Returns (distance, whether first was chopped)."""
+    return Levenshtein.Matcher(second).score(first)
 
 
 def find_next_non_blank(list, start=0):
@@ -475,41 +460,33 @@ def convert_to_haiku(message):
 
 
 def binary_search(a, x, lo=0, hi=None):
+    if isinstance(a, WordIndex):
+        return a.search(x)
     hi = hi if hi is not None else len(a)
     pos = bisect_left(a, x, lo, hi)
     return pos if pos != hi and a[pos] == x else ~pos
 
 
 def add_word(word):
-    pos = binary_search(word_list, word)
-    if pos > -1:
-        return
-    word_list.insert(~pos, word)
-    global words
-    words = open('wordlist.txt', 'w+')
-    words.seek(0)
-    for word in word_list:
-        words.write(word + '\n')
-    words.close()
-
-
-def unhashtag(self, message):
-    hashtagged = str(message)
-    pattern = re.compile(r'(#[a-zA-Z]+\'*[a-zA-Z]*)')
-    matches = pattern.findall(hashtagged)
+    if get_word_index().add(word) and hashtag_segmenter is not None:
+        hashtag_segmenter.clear_cache()
+
+
+def get_hashtag_segmenter():
+    global hashtag_segmenter
+    if hashtag_segmenter is None:
+        hashtag_segmenter = HashtagSegmenter(get_word_index())
+    return hashtag_segmenter
+
+
+def unhashtag(message):
+    """Splits each hashtag in message into words. Returns a list of strings: each word followed by a space, anything
+    that isn't a word in [brackets], and a newline after each hashtag. Returns None if there are no hashtags."""
+    segmenter = get_hashtag_segmenter()
     to_return = []
-    for match in matches:
-        match = match[1:]
-        x = len(match)
-        while x > 0:
-            if self.binary_search(self.list, match[0:x].lower()) > -1:
-                to_return.append(match[0:x] + ' ')
-                match = match[x:]
-                x = len(match)
-            else:
-                x -= 1
-        if len(match) > 0:
-            to_return.append('[' + match + ']')
+    for tag in find_hashtags(str(message)):
+        for piece, is_word in segmenter.segment(tag):
+            to_return.append(piece + ' ' if is_word else '[' + piece + ']')
         to_return.append('\n')
     return to_return if to_return != [] else None
 
@@ -561,12 +538,9 @@ def set_last_recorded(conv_id, last_recorded):
 
 
 def change_karma(user_id, karma):
-    user_karma = UtilDB.get_value_by_user_id("karma", user_id)
-    if user_karma is not None:
-        user_karma = user_karma[1]
-    else:
-        user_karma = 0
-    UtilDB.set_value_by_user_id("karma", user_id, "karma", (user_karma + karma))
+    with UtilDB.transaction():
+        user_karma = get_current_karma(user_id)
+        UtilDB.set_value_by_user_id("karma", user_id, "karma", (user_karma + karma))
     return user_karma + karma
 
 
@@ -578,34 +552,28 @@ def get_current_karma(user_id):
         return 0
 
 
+def get_karma_for_users(user_ids):
+    """Returns a dict of user_id -> karma for every user in user_ids, in a single query."""
+    user_ids = list(user_ids)
+    rows = UtilDB.get_values_for_users("karma", user_ids)
+    return {user_id: rows[user_id][1] if user_id in rows else 0 for user_id in user_ids}
+
+
 def add_reminder(conv_id, message, time):
-    db_file = UtilDB.get_database()
-    database = sqlite3.connect(db_file)
-    cursor = database.cursor()
-    cursor.execute("INSERT INTO reminders VALUES (?, ?, ?)", (conv_id, message, time))
-    database.commit()
-    database.close()
+    """Saves a reminder and returns its id."""
+    with UtilDB.transaction() as connection:
+        return connection.execute("INSERT INTO reminders (conv_id, message, timestamp) VALUES (?, ?, ?)",
+                                  (conv_id, message, str(time))).lastrowid
 
 
 def get_all_reminders(conv_id=None):
-    db_file = UtilDB.get_database()
-    database = sqlite3.connect(db_file)
-    cursor = database.cursor()
+    """Returns (id, conv_id, message, timestamp) for every reminder, soonest first."""
     if not conv_id:
-        return cursor.execute("SELECT * FROM reminders").fetchall()
+        return UtilDB.fetchall("SELECT id, conv_id, message, timestamp FROM reminders ORDER BY timestamp, id")
     else:
-        return cursor.execute("SELECT * FROM reminders WHERE conv_id = ?", (conv_id,)).fetchall()
-
-
-def delete_reminder(conv_id, message, time):
-    db_file = UtilDB.get_database()
-    database = sqlite3.connect(db_file)
-    cursor = database.cursor()
-    timestamp = datetime.now() + timedelta(seconds=time)
-    # I have an issue with the timestamps not being exact. I need a better way of being exact.
-    # This should work for most cases, but will fail under some circumstances.
-    cursor.execute(
-        'DELETE FROM reminders WHERE conv_id = ? AND message = ? AND timestamp - ? <= 20',
-        (conv_id, message, timestamp))
-    database.commit()
-    database.close()
\ No newline at end of file
+        return UtilDB.fetchall("SELECT id, conv_id, message, timestamp FROM reminders WHERE conv_id = ? "
+                               "ORDER BY timestamp, id", (conv_id,))
+
+
+def delete_reminder(reminder_id):
+    return UtilDB.execute("DELETE FROM reminders WHERE id = ?", (reminder_id,)) > 0
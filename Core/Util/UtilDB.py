@@ -1,90 +1,179 @@
+from contextlib import contextmanager
 import sqlite3
+import threading
 
 _database_file = None
 
+# One long-lived connection shared by every helper. sqlite3 caches the prepared statement for each distinct SQL string
+# on the connection, so reusing it also saves re-parsing the same queries on every call.
+_connection = None
+_lock = threading.RLock()
+_transaction_depth = 0
+
+# SQLite refuses statements with more than 999 bound parameters.
+_MAX_VARIABLES = 500
+
 
 class DatabaseNotInitializedError(BaseException):
     pass
 
 
 def setDatabase(db):
-    global _database_file
+    global _database_file, _connection
+    close()
     _database_file = db
+    _connection = _connect(db)
     _init_tables()
 
 
-def _init_tables():
-    if _database_file:
-        database = sqlite3.connect(_database_file)
-        cursor = database.cursor()
-
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='karma'")
-        if not cursor.fetchone():
-            cursor.execute("CREATE TABLE karma (user_id text, karma integer)")
-
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='reminders'")
-        if not cursor.fetchone():
-            cursor.execute(
-                "CREATE TABLE reminders (conv_id text, message text, timestamp integer)")
-
-        database.commit()
-        cursor.close()
-        database.close()
-    else:
+def _connect(db):
+    # isolation_level=None stops sqlite3 from beginning and committing transactions by itself (older versions commit
+    # before any statement that isn't plain DML, savepoints included); transaction() issues BEGIN/COMMIT explicitly.
+    connection = sqlite3.connect(db, check_same_thread=False, cached_statements=256, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+def close():
+    global _connection
+    with _lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+
+
+def get_connection():
+    if _connection is None:
         raise DatabaseNotInitializedError()
+    return _connection
+
+
+@contextmanager
+def transaction():
+    """Runs the enclosed statements in a single transaction. Nested transactions join the outermost one, which is the
+    only one that commits."""
+    global _transaction_depth
+    with _lock:
+        connection = get_connection()
+        if _transaction_depth == 0:
+            connection.execute("BEGIN")
+        _transaction_depth += 1
+        try:
+            yield connection
+        except BaseException:
+            _transaction_depth -= 1
+            # SQLite rolls back by itself after some errors, leaving nothing to roll back.
+            if _transaction_depth == 0 and connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+        _transaction_depth -= 1
+        if _transaction_depth == 0:
+            connection.execute("COMMIT")
+
+
+@contextmanager
+def savepoint():
+    """Runs the enclosed statements inside the current transaction (or a new one), undoing just them if they raise."""
+    with transaction() as connection:
+        name = "savepoint_{}".format(_transaction_depth)
+        connection.execute("SAVEPOINT " + name)
+        try:
+            yield connection
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK TO " + name)
+                connection.execute("RELEASE " + name)
+            raise
+        connection.execute("RELEASE " + name)
+
+
+def execute(sql, params=()):
+    with transaction() as connection:
+        return connection.execute(sql, params).rowcount
+
+
+def fetchone(sql, params=()):
+    with _lock:
+        return get_connection().execute(sql, params).fetchone()
+
+
+def fetchall(sql, params=()):
+    with _lock:
+        return get_connection().execute(sql, params).fetchall()
 
 
-def get_value_by_user_id(table, user_id, conv_id=None):
-    if _database_file:
-        database = sqlite3.connect(_database_file)
-        cursor = database.cursor()
-        if conv_id:
-            cursor.execute("SELECT * FROM %s WHERE user_id = ? AND conv_id = ?" % table, (user_id, conv_id))
-        else:
-            cursor.execute("SELECT * FROM %s WHERE user_id = ?" % table, (user_id,))
-        return cursor.fetchone()
+def _init_tables():
+    with transaction() as connection:
+        connection.execute("CREATE TABLE IF NOT EXISTS karma (user_id text, karma integer)")
+        connection.execute("CREATE INDEX IF NOT EXISTS karma_user_id ON karma (user_id)")
+        connection.execute("CREATE TABLE IF NOT EXISTS reminders "
+                           "(id integer PRIMARY KEY, conv_id text, message text, timestamp integer)")
+        _migrate_reminders(connection)
+        connection.execute("CREATE TABLE IF NOT EXISTS result_cache "
+                           "(command text, key text, value text, expires real, PRIMARY KEY (command, key))")
+
+
+def _migrate_reminders(connection):
+    """Gives reminders tables from before reminders had ids an id column. Their implicit rowids were used as ids, but
+    VACUUM may renumber those, so they're copied into an explicit (and stable) primary key once."""
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(reminders)")]
+    if 'id' in columns:
+        return
+    connection.execute("CREATE TABLE reminders_new "
+                       "(id integer PRIMARY KEY, conv_id text, message text, timestamp integer)")
+    connection.execute("INSERT INTO reminders_new (id, conv_id, message, timestamp) "
+                       "SELECT rowid, conv_id, message, timestamp FROM reminders")
+    connection.execute("DROP TABLE reminders")
+    connection.execute("ALTER TABLE reminders_new RENAME TO reminders")
+
 
+def get_value_by_user_id(table, user_id, conv_id=None):
+    if conv_id:
+        return fetchone("SELECT * FROM %s WHERE user_id = ? AND conv_id = ?" % table, (user_id, conv_id))
     else:
-        raise DatabaseNotInitializedError()
+        return fetchone("SELECT * FROM %s WHERE user_id = ?" % table, (user_id,))
 
 
 def get_values_by_user_id(table, user_id, conv_id=None):
-    if _database_file:
-        database = sqlite3.connect(_database_file)
-        cursor = database.cursor()
+    if conv_id:
+        return fetchall("SELECT * FROM %s WHERE user_id = ? AND conv_id = ?" % table, (user_id, conv_id))
+    else:
+        return fetchall("SELECT * FROM %s WHERE user_id = ?" % table, (user_id,))
+
+
+def get_values_for_users(table, user_ids, conv_id=None):
+    """Returns a dict of user_id -> row for every user in user_ids that has a row in table."""
+    user_ids = list(user_ids)
+    results = {}
+    for start in range(0, len(user_ids), _MAX_VARIABLES):
+        chunk = user_ids[start:start + _MAX_VARIABLES]
+        placeholders = ', '.join('?' * len(chunk))
         if conv_id:
-            cursor.execute("SELECT * FROM %s WHERE user_id = ? AND conv_id = ?" % table, (user_id, conv_id))
+            rows = fetchall("SELECT * FROM %s WHERE conv_id = ? AND user_id IN (%s)" % (table, placeholders),
+                            [conv_id] + chunk)
         else:
-            cursor.execute("SELECT * FROM %s WHERE user_id = ?" % table, (user_id,))
-        return cursor.fetchall()
-
-    else:
-        raise DatabaseNotInitializedError()
+            rows = fetchall("SELECT * FROM %s WHERE user_id IN (%s)" % (table, placeholders), chunk)
+        for row in rows:
+            results.setdefault(row[0], row)
+    return results
 
 
 def set_value_by_user_id(table, user_id, keyword, value, conv_id=None):
-    if _database_file:
-        database = sqlite3.connect(_database_file)
-        cursor = database.cursor()
+    with transaction() as connection:
+        result = get_value_by_user_id(table, user_id, conv_id)
         if conv_id:
-            result = get_value_by_user_id(table, user_id, conv_id)
             if result:
-                cursor.execute("UPDATE %s SET %s = ? WHERE user_id = ? and conv_id = ?" % (table, keyword),
-                               (keyword, value, user_id, conv_id))
+                connection.execute("UPDATE %s SET %s = ? WHERE user_id = ? and conv_id = ?" % (table, keyword),
+                                   (value, user_id, conv_id))
             else:
-                cursor.execute("INSERT INTO %s VALUES (?, ?, ?)" % table, (user_id, conv_id, value))
+                connection.execute("INSERT INTO %s VALUES (?, ?, ?)" % table, (user_id, conv_id, value))
         else:
-            result = get_value_by_user_id(table, user_id, conv_id)
             if result:
-                cursor.execute("UPDATE %s SET %s = ? WHERE user_id = ?" % (table, keyword), (value, user_id))
+                connection.execute("UPDATE %s SET %s = ? WHERE user_id = ?" % (table, keyword), (value, user_id))
             else:
-                cursor.execute("INSERT INTO %s VALUES (?, ?)" % table, (user_id, value))
-        database.commit()
-    else:
-        raise DatabaseNotInitializedError()
+                connection.execute("INSERT INTO %s VALUES (?, ?)" % table, (user_id, value))
+
 
 def get_database():
     return _database_file
-
-
-
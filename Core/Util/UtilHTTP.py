@@ -0,0 +1,134 @@
+import asyncio
+import json
+import re
+from urllib import parse
+from urllib.error import HTTPError, URLError
+
+import aiohttp
+
+from Core.Util.LazyImport import lazy_import
+
+bs4 = lazy_import('bs4')
+
+''' Shared, loop-native HTTP client for commands. Connections are kept alive and pooled per host by a single aiohttp
+connector, every request has a timeout, and the number of requests in flight is capped both overall and per host, so
+one slow site can't stall every other chat. Responses are gzip/deflate decoded transparently.
+
+Failures are raised as urllib.error exceptions so existing "except HTTPError" / "except URLError" handling keeps working:
+an error status raises HTTPError, and a timeout or connection problem raises URLError.'''
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 6.3; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/37.0.2049.0 ' \
+             'Safari/537.36'
+DEFAULT_TIMEOUT = 15
+MAX_CONCURRENT_REQUESTS = 20
+MAX_REQUESTS_PER_HOST = 4
+KEEPALIVE_TIMEOUT = 30
+
+_connector = None
+_request_limit = None
+_host_limits = {}
+
+
+class Response(object):
+    """A fully read HTTP response."""
+
+    def __init__(self, url, status, headers, body, cookies=None):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.cookies = cookies
+
+    @property
+    def encoding(self):
+        content_type = self.headers.get('Content-Type', '') if self.headers else ''
+        match = re.search(r'charset=([\w-]+)', content_type, re.IGNORECASE)
+        return match.group(1) if match else 'utf-8'
+
+    def text(self, encoding=None):
+        try:
+            return self.body.decode(encoding or self.encoding, errors='replace')
+        except LookupError:
+            return self.body.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.text())
+
+
+def _get_connector():
+    global _connector
+    if _connector is None or _connector.closed:
+        _connector = aiohttp.TCPConnector(keepalive_timeout=KEEPALIVE_TIMEOUT)
+    return _connector
+
+
+def _get_limits(url):
+    global _request_limit
+    if _request_limit is None:
+        _request_limit = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    host = parse.urlsplit(url).netloc.lower()
+    if host not in _host_limits:
+        _host_limits[host] = asyncio.Semaphore(MAX_REQUESTS_PER_HOST)
+    return _request_limit, _host_limits[host]
+
+
+@asyncio.coroutine
+def _request(method, url, headers, data, params, cookies, allow_redirects):
+    response = yield from aiohttp.request(method, url, headers=headers, data=data, params=params, cookies=cookies,
+                                          allow_redirects=allow_redirects, connector=_get_connector())
+    try:
+        body = yield from response.read()
+    except BaseException:
+        response.close()
+        raise
+    return Response(str(response.url), response.status, response.headers, body, response.cookies)
+
+
+@asyncio.coroutine
+def fetch(url, method='GET', headers=None, data=None, params=None, cookies=None, timeout=DEFAULT_TIMEOUT,
+          allow_redirects=True, raise_for_status=True):
+    """Performs a request and returns a Response once its whole body has been read."""
+    request_headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip, deflate'}
+    if headers:
+        request_headers.update(headers)
+
+    request_limit, host_limit = _get_limits(url)
+    with (yield from request_limit):
+        with (yield from host_limit):
+            try:
+                response = yield from asyncio.wait_for(
+                    _request(method, url, request_headers, data, params, cookies, allow_redirects), timeout)
+            except asyncio.TimeoutError:
+                raise URLError('Timed out after {} seconds fetching {}'.format(timeout, url))
+            except (aiohttp.ClientError, OSError, ValueError) as e:
+                raise URLError(e)
+
+    if raise_for_status and response.status >= 400:
+        raise HTTPError(url, response.status, 'HTTP Error {}'.format(response.status), response.headers, None)
+    return response
+
+
+@asyncio.coroutine
+def fetch_text(url, **kwargs):
+    response = yield from fetch(url, **kwargs)
+    return response.text()
+
+
+@asyncio.coroutine
+def fetch_json(url, **kwargs):
+    response = yield from fetch(url, **kwargs)
+    return response.json()
+
+
+@asyncio.coroutine
+def fetch_soup(url, **kwargs):
+    response = yield from fetch(url, **kwargs)
+    return bs4.BeautifulSoup(response.text())
+
+
+def close():
+    """Closes every pooled connection."""
+    global _connector
+    if _connector is not None:
+        _connector.close()
+        _connector = None
@@ -0,0 +1,139 @@
+import datetime
+import glob
+import os
+import sqlite3
+import time
+
+from Core.Util import UtilDB
+
+''' Storage for the /record command. Records live in the records table of the bot's database, one row per recorded
+line, keyed by conversation, day and author. When the SQLite build has FTS5, a records_fts index on the text gives
+ranked full-text search; otherwise searches fall back to LIKE over the conversation's rows.
+
+These functions block on the database, so commands should call them through AsyncDB.run. Records saved by older
+versions as Records/<conv_id>/<date>.txt files are imported once by import_records.'''
+
+RECORDS_DIRECTORY = 'Records'
+PAGE_SIZE = 10
+
+_fts_available = False
+
+
+def init_tables():
+    global _fts_available
+    with UtilDB.transaction() as connection:
+        connection.execute("CREATE TABLE IF NOT EXISTS records (id integer PRIMARY KEY, conv_id text, day text, "
+                           "author_id text, text text, created real)")
+        connection.execute("CREATE INDEX IF NOT EXISTS records_conv_day ON records (conv_id, day, id)")
+        connection.execute("CREATE TABLE IF NOT EXISTS records_imported (path text PRIMARY KEY)")
+    try:
+        with UtilDB.transaction() as connection:
+            connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS records_fts "
+                               "USING fts5(text, content='records', content_rowid='id')")
+            connection.execute("CREATE TRIGGER IF NOT EXISTS records_fts_insert AFTER INSERT ON records BEGIN "
+                               "INSERT INTO records_fts (rowid, text) VALUES (new.id, new.text); END")
+            connection.execute("CREATE TRIGGER IF NOT EXISTS records_fts_delete AFTER DELETE ON records BEGIN "
+                               "INSERT INTO records_fts (records_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+                               "END")
+        _fts_available = True
+    except sqlite3.OperationalError:
+        # No FTS5 in this SQLite build.
+        _fts_available = False
+
+
+def _day(day=None):
+    return str(day or datetime.date.today())
+
+
+def add_record(conv_id, text, author_id=None, day=None):
+    """Saves a line to the conversation's record for day (today by default) and returns its id."""
+    with UtilDB.transaction() as connection:
+        cursor = connection.execute("INSERT INTO records (conv_id, day, author_id, text, created) VALUES (?, ?, ?, ?, ?)",
+                                    (str(conv_id), _day(day), author_id, text, time.time()))
+        return cursor.lastrowid
+
+
+def get_records(conv_id, day=None):
+    """Returns the lines recorded on day (today by default), oldest first."""
+    return [row[0] for row in UtilDB.fetchall("SELECT text FROM records WHERE conv_id = ? AND day = ? ORDER BY id",
+                                              (str(conv_id), _day(day)))]
+
+
+def delete_record(conv_id, record_id):
+    return UtilDB.execute("DELETE FROM records WHERE conv_id = ? AND id = ?", (str(conv_id), record_id)) > 0
+
+
+def clear_day(conv_id, day=None):
+    return UtilDB.execute("DELETE FROM records WHERE conv_id = ? AND day = ?", (str(conv_id), _day(day)))
+
+
+def list_days(conv_id, page=1, page_size=PAGE_SIZE):
+    """Returns a page of (day, number of lines) for every day with records, newest first."""
+    return UtilDB.fetchall("SELECT day, COUNT(*) FROM records WHERE conv_id = ? GROUP BY day ORDER BY day DESC "
+                           "LIMIT ? OFFSET ?", (str(conv_id), page_size, (page - 1) * page_size))
+
+
+def get_records_between(conv_id, start, end, page=1, page_size=PAGE_SIZE):
+    """Returns a page of (day, text) recorded from start to end inclusive, oldest first."""
+    return UtilDB.fetchall("SELECT day, text FROM records WHERE conv_id = ? AND day BETWEEN ? AND ? ORDER BY day, id "
+                           "LIMIT ? OFFSET ?", (str(conv_id), _day(start), _day(end), page_size,
+                                                (page - 1) * page_size))
+
+
+def _fts_query(terms):
+    # Quote every term so user input can't be read as FTS query syntax, and prefix match it so partial words still
+    # find something. The terms are implicitly ANDed.
+    return ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+
+def search_records(conv_id, terms, start=None, end=None, page=1, page_size=PAGE_SIZE):
+    """Returns a page of (day, text) for records containing every one of terms, best matches first. start and end
+    optionally limit the search to a range of days."""
+    terms = [term for term in terms if term.strip()]
+    if not terms:
+        return []
+    conditions = ["records.conv_id = ?"]
+    params = [str(conv_id)]
+    if start is not None:
+        conditions.append("records.day >= ?")
+        params.append(_day(start))
+    if end is not None:
+        conditions.append("records.day <= ?")
+        params.append(_day(end))
+    limit = [page_size, (page - 1) * page_size]
+
+    if _fts_available:
+        try:
+            return UtilDB.fetchall("SELECT records.day, records.text FROM records_fts "
+                                   "JOIN records ON records.id = records_fts.rowid "
+                                   "WHERE records_fts MATCH ? AND " + ' AND '.join(conditions) +
+                                   " ORDER BY records_fts.rank, records.day DESC LIMIT ? OFFSET ?",
+                                   [_fts_query(terms)] + params + limit)
+        except sqlite3.OperationalError:
+            pass
+
+    for term in terms:
+        conditions.append("records.text LIKE ? ESCAPE '\\'")
+        params.append('%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+    return UtilDB.fetchall("SELECT records.day, records.text FROM records WHERE " + ' AND '.join(conditions) +
+                           " ORDER BY records.day DESC, records.id LIMIT ? OFFSET ?", params + limit)
+
+
+def import_records(directory=RECORDS_DIRECTORY):
+    """Imports Records/<conv_id>/<date>.txt files written by older versions. Each file is only ever imported once, and
+    the files themselves are left alone. Returns the number of lines imported."""
+    imported = 0
+    for path in sorted(glob.glob(os.path.join(directory, '*', '*.txt'))):
+        conv_id = os.path.basename(os.path.dirname(path))
+        day = os.path.splitext(os.path.basename(path))[0]
+        with UtilDB.transaction() as connection:
+            if connection.execute("SELECT 1 FROM records_imported WHERE path = ?", (path,)).fetchone():
+                continue
+            with open(path, encoding='utf-8', errors='replace') as file:
+                lines = [line.rstrip('\n') for line in file if line.strip()]
+            created = os.path.getmtime(path)
+            connection.executemany("INSERT INTO records (conv_id, day, author_id, text, created) VALUES (?, ?, ?, ?, ?)",
+                                   [(conv_id, day, None, line, created) for line in lines])
+            connection.execute("INSERT INTO records_imported VALUES (?)", (path,))
+            imported += len(lines)
+    return imported
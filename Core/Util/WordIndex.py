@@ -0,0 +1,260 @@
+import bisect
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import traceback
+
+''' Sorted word list kept on disk and searched in place, instead of as a list of 100k+ Python strings.
+
+The words of a text file (one per line) are sorted into an index file: a header, a table of offsets, and the words
+themselves, UTF-8 encoded and packed together. The index is memory-mapped and binary searched directly, so it costs a
+couple of MB of (shared, reclaimable) page cache rather than several MB of heap, and opening it reads nothing but the
+header. UTF-8 bytes sort in the same order as the strings they encode, so comparisons are done on bytes.
+
+Added words are appended to a journal file next to the index and kept in a small sorted list in memory. Once
+MERGE_THRESHOLD of them have piled up they are merged into a new index by a background thread, which swaps it in
+atomically (closing the old map first, since Windows can't replace a file that's mapped). The text file itself is never
+rewritten. The index records how much of the journal it includes, and is rebuilt from the text file and the whole
+journal whenever the text file changes or the index is missing or damaged.'''
+
+MERGE_THRESHOLD = 256
+
+_MAGIC = b'WORDIDX1'
+_HEADER = struct.Struct('<8sQQQQ')  # magic, word count, text file size, text file mtime, journal bytes included
+_OFFSET = struct.Struct('<I')
+
+
+class WordIndex(object):
+    def __init__(self, text_path, index_path=None, journal_path=None, merge_threshold=MERGE_THRESHOLD):
+        root = os.path.splitext(text_path)[0]
+        self.text_path = text_path
+        self.index_path = index_path or root + '.idx'
+        self.journal_path = journal_path or root + '.journal'
+        self.merge_threshold = merge_threshold
+        self._lock = threading.Lock()
+        self._merge_lock = threading.Lock()  # Held by whichever thread is merging; only merging swaps the map.
+        self._merging = None
+        self._map = None
+        self._count = 0
+        self._words_start = 0
+        self._added = []  # Sorted encoded words from the journal that aren't in the index yet.
+        self._open()
+
+    # Loading and building
+
+    def _text_stat(self):
+        stat = os.stat(self.text_path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def _journal_size(self):
+        try:
+            return os.path.getsize(self.journal_path)
+        except OSError:
+            return 0
+
+    def _read_journal(self, start=0):
+        try:
+            with open(self.journal_path, 'rb') as journal:
+                journal.seek(start)
+                data = journal.read()
+        except OSError:
+            return []
+        # A line cut short by a crash has no newline yet; leave it out.
+        return [line.strip() for line in data.split(b'\n')[:-1] if line.strip()]
+
+    def _open(self):
+        header = self._read_header()
+        if header is None or header[2:4] != self._text_stat():
+            with open(self.text_path, 'rb') as text:
+                words = set(line.strip() for line in text)
+            words.update(self._read_journal())
+            words.discard(b'')
+            os.replace(self._write_index(sorted(words), self._journal_size()), self.index_path)
+            header = self._read_header()
+        self._load(header)
+        self._added = sorted(set(word for word in self._read_journal(header[4]) if not self._in_index(word)))
+
+    def _read_header(self):
+        try:
+            with open(self.index_path, 'rb') as index:
+                data = index.read(_HEADER.size)
+        except OSError:
+            return None
+        if len(data) < _HEADER.size:
+            return None
+        header = _HEADER.unpack(data)
+        if header[0] != _MAGIC:
+            return None
+        expected = _HEADER.size + (header[1] + 1) * _OFFSET.size
+        if os.path.getsize(self.index_path) < expected:
+            return None
+        return header
+
+    def _write_index(self, words, journal_bytes):
+        """Writes an index of words (sorted, encoded, unique) to a temporary file next to the index, and returns its
+        path, for os.replace to move into place."""
+        text_size, text_mtime = self._text_stat()
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.index_path)), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as index:
+                index.write(_HEADER.pack(_MAGIC, len(words), text_size, text_mtime, journal_bytes))
+                offset = 0
+                offsets = bytearray()
+                for word in words:
+                    offsets += _OFFSET.pack(offset)
+                    offset += len(word)
+                offsets += _OFFSET.pack(offset)
+                index.write(offsets)
+                index.write(b''.join(words))
+                index.flush()
+                os.fsync(index.fileno())
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return temp_path
+
+    def _load(self, header):
+        with open(self.index_path, 'rb') as index:
+            self._map = mmap.mmap(index.fileno(), 0, access=mmap.ACCESS_READ)
+        self._count = header[1]
+        self._words_start = _HEADER.size + (header[1] + 1) * _OFFSET.size
+
+    # Searching
+
+    def _word(self, i):
+        start, end = struct.unpack_from('<II', self._map, _HEADER.size + i * _OFFSET.size)
+        return self._map[self._words_start + start:self._words_start + end]
+
+    def _rank(self, word):
+        """Number of indexed words that sort before word."""
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._word(mid) < word:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _in_index(self, word):
+        rank = self._rank(word)
+        return rank < self._count and self._word(rank) == word
+
+    def search(self, word):
+        """Like UtilBot.binary_search over the sorted words: the word's position if it's there, otherwise ~ the
+        position it would be inserted at."""
+        encoded = word.encode('utf-8')
+        with self._lock:
+            rank = self._rank(encoded)
+            added_rank = bisect.bisect_left(self._added, encoded)
+            found = (rank < self._count and self._word(rank) == encoded) or \
+                    (added_rank < len(self._added) and self._added[added_rank] == encoded)
+        position = rank + added_rank
+        return position if found else ~position
+
+    def lookup(self, prefix):
+        """Returns (whether prefix is a word, whether any word starts with it). Checking longer and longer prefixes this
+        way walks the sorted words like a trie."""
+        encoded = prefix.encode('utf-8')
+        with self._lock:
+            rank = self._rank(encoded)
+            following = self._word(rank) if rank < self._count else None
+            added_rank = bisect.bisect_left(self._added, encoded)
+            added = self._added[added_rank] if added_rank < len(self._added) else None
+        is_word = following == encoded or added == encoded
+        is_prefix = (following is not None and following.startswith(encoded)) or \
+                    (added is not None and added.startswith(encoded))
+        return is_word, is_prefix
+
+    def __contains__(self, word):
+        return self.search(word) >= 0
+
+    def __len__(self):
+        with self._lock:
+            return self._count + len(self._added)
+
+    def __iter__(self):
+        # Copied under the lock, since a merge closes the map it would otherwise be read from.
+        with self._lock:
+            indexed = [self._word(i) for i in range(self._count)]
+            added = list(self._added)
+        for word in _merge_sorted(indexed, added):
+            yield word.decode('utf-8')
+
+    # Adding
+
+    def add(self, word):
+        """Adds word. Returns False if it was already there."""
+        encoded = word.strip().encode('utf-8')
+        if not encoded or b'\n' in encoded:
+            raise ValueError('Not a word: {!r}'.format(word))
+        with self._lock:
+            if self._in_index(encoded):
+                return False
+            position = bisect.bisect_left(self._added, encoded)
+            if position < len(self._added) and self._added[position] == encoded:
+                return False
+            with open(self.journal_path, 'ab') as journal:
+                journal.write(encoded + b'\n')
+            self._added.insert(position, encoded)
+            if len(self._added) >= self.merge_threshold and self._merging is None:
+                self._merging = threading.Thread(target=self._merge_in_background, name='WordIndexMerge',
+                                                 daemon=True)
+                self._merging.start()
+        return True
+
+    def merge(self):
+        """Merges the journal into the index now, on the calling thread."""
+        with self._lock:
+            merging = self._merging
+        if merging is not None:
+            merging.join()
+        self._merge()
+
+    def _merge_in_background(self):
+        try:
+            self._merge()
+        except Exception:
+            # The words stay in the journal, and the next merge tries again.
+            traceback.print_exc()
+        finally:
+            with self._lock:
+                self._merging = None
+
+    def _merge(self):
+        with self._merge_lock:
+            with self._lock:
+                count, added = self._count, list(self._added)
+                journal_bytes = self._journal_size()
+            if not added:
+                return
+            # Read without the lock: the map only changes below, and no other merge can run meanwhile.
+            indexed = (self._word(i) for i in range(count))
+            temp_path = self._write_index(list(_merge_sorted(indexed, added)), journal_bytes)
+            with self._lock:
+                self._map.close()
+                try:
+                    os.replace(temp_path, self.index_path)
+                except OSError:
+                    os.unlink(temp_path)
+                    raise
+                finally:
+                    self._load(self._read_header())
+                merged = set(added)
+                self._added = [word for word in self._added if word not in merged]
+
+
+def _merge_sorted(first, second):
+    """Merges two sorted iterables of distinct items."""
+    second = iter(second)
+    pending = next(second, None)
+    for item in first:
+        while pending is not None and pending < item:
+            yield pending
+            pending = next(second, None)
+        yield item
+    while pending is not None:
+        yield pending
+        pending = next(second, None)
@@ -224,6 +224,22 @@ def _get_paginated_results(url, parser):
 
 
 # Search functions
+def build_search_url(search):
+    """
+    Returns the URL of the song search page for search, for callers that do their own fetching
+    """
+
+    return _build_query_url(RAPGENIUS_SEARCH_URL, search)
+
+
+def parse_search(soup):
+    """
+    Returns the songs listed on an already fetched search page as a list of Song objects
+    """
+
+    return _parse_search(soup)
+
+
 def search_songs(search):
     """
     Searches Rap Genius for all songs matching search,
@@ -276,13 +292,20 @@ def get_lyrics_from_url(url):
     Returns string of (unannotated) lyrics, given a URL
     """
 
-    soup = _get_soup(url)
+    return parse_lyrics(_get_soup(url))
+
+
+def parse_lyrics(soup):
+    """
+    Returns string of (unannotated) lyrics, given an already fetched song page
+    """
+
     ret = ""
     for row in soup('div', {'class': 'lyrics'}):
         text = ''.join(row.findAll(text=True))
         data = text.strip() + '\n'
         ret += data
-    return data
+    return ret
 
 
 def get_song_artist(url):
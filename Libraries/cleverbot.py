@@ -80,6 +80,8 @@ class _Cleverbot(ChatterBot):
 
 
 class _CleverbotSession(ChatterBotSession):
+    home_url = 'http://www.cleverbot.com'
+
     def __init__(self, bot):
         self.bot = bot
         self.vars = {}
@@ -91,17 +93,24 @@ class _CleverbotSession(ChatterBotSession):
         self.vars['cleanslate'] = 'false'
 
     def think_thought(self, thought):
+        data = self.prepare_thought(thought)
+        cj = cookiejar.CookieJar()
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(cj))
+        opener.open(self.home_url)
+        url_response = opener.open(self.bot.url, data)
+        return self.process_response(url_response.read())
+
+    # The request building and response parsing are split out of think_thought so callers can do the HTTP themselves
+    # (e.g. asynchronously): GET home_url for the session cookies, then POST prepare_thought()'s data to bot.url.
+    def prepare_thought(self, thought):
         self.vars['stimulus'] = thought.text
         data = urllib.parse.urlencode(self.vars)
         data_to_digest = data[9:self.bot.endIndex]
         data_digest = hashlib.md5(data_to_digest.encode('utf-8')).hexdigest()
         data = data + '&icognocheck=' + data_digest
-        data = data.encode('utf-8')
-        cj = cookiejar.CookieJar()
-        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(cj))
-        opener.open('http://www.cleverbot.com')
-        url_response = opener.open(self.bot.url, data)
-        response = url_response.read()
+        return data.encode('utf-8')
+
+    def process_response(self, response):
         response_values = response.decode('utf-8').split('\r')
         # self.vars['??'] = _utils_string_at_index(response_values, 0)
         self.vars['sessionid'] = _utils_string_at_index(response_values, 1)
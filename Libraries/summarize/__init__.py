@@ -1,3 +1,4 @@
 __version__ = '0.0.1'
 
-from .summarize import Summary, summarize_blocks, summarize_page, summarize_text
\ No newline at end of file
+from .summarize import Summary, summarize_blocks, summarize_html, summarize_page, summarize_text
+from .pool import SummarizePool, SummarizeBusyError, SummarizeTimeoutError
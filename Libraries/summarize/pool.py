@@ -0,0 +1,101 @@
+"""Runs summarize_page/summarize_text/summarize_html in a pool of worker processes and exposes them as asyncio
+coroutines, so summarizing a long article doesn't freeze an event loop (or, in process mode, hold its GIL)."""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from . import summarize
+
+
+class SummarizeBusyError(Exception):
+    """Raised when the pool already has max_pending jobs queued or running"""
+
+
+class SummarizeTimeoutError(Exception):
+    """Raised when a job takes longer than the pool's timeout"""
+
+
+def _detach(summary):
+    # BeautifulSoup trees don't pickle well, so hand the article back as markup.
+    if summary.article_html is not None:
+        summary.article_html = str(summary.article_html)
+    return summary
+
+
+def _summarize_page(url):
+    return _detach(summarize.summarize_page(url))
+
+
+def _summarize_html(url, html):
+    return _detach(summarize.summarize_html(url, html))
+
+
+def _summarize_text(text, block_sep, url, title):
+    return summarize.summarize_text(text, block_sep=block_sep, url=url, title=title)
+
+
+class SummarizePool(object):
+    """Bounded pool of summarizer workers.
+
+    mode is 'process' (default) or 'thread'. At most max_pending jobs may be queued or running at once; more raise
+    SummarizeBusyError instead of piling up. A job that runs longer than timeout seconds raises SummarizeTimeoutError.
+    A job that has already started can't be interrupted, so its worker stays busy until it finishes.
+    """
+
+    def __init__(self, max_workers=2, max_pending=8, timeout=30, mode='process'):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.mode = mode
+        self.pending = 0
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.mode == 'process':
+                self._executor = ProcessPoolExecutor(self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(self.max_workers)
+        return self._executor
+
+    @asyncio.coroutine
+    def _run(self, func, *args):
+        if self.pending >= self.max_pending:
+            raise SummarizeBusyError('{} summaries are already pending'.format(self.pending))
+        loop = asyncio.get_event_loop()
+        concurrent_future = self._get_executor().submit(func, *args)
+        # The slot is held until the job itself finishes, even if nothing waits for it any more after a timeout.
+        self.pending += 1
+        concurrent_future.add_done_callback(lambda _: self._release(loop))
+        future = asyncio.wrap_future(concurrent_future, loop=loop)
+        try:
+            return (yield from asyncio.wait_for(future, self.timeout))
+        except asyncio.TimeoutError:
+            raise SummarizeTimeoutError('Summarizing took longer than {} seconds'.format(self.timeout))
+
+    def _release(self, loop):
+        """Frees a job's slot; called from the worker thread when the job finishes."""
+        try:
+            loop.call_soon_threadsafe(self._decrement)
+        except RuntimeError:
+            pass  # The loop is closed, so nothing will submit jobs any more.
+
+    def _decrement(self):
+        self.pending -= 1
+
+    @asyncio.coroutine
+    def summarize_page(self, url):
+        return (yield from self._run(_summarize_page, url))
+
+    @asyncio.coroutine
+    def summarize_html(self, url, html):
+        return (yield from self._run(_summarize_html, url, html))
+
+    @asyncio.coroutine
+    def summarize_text(self, text, block_sep='\n\n', url=None, title=None):
+        return (yield from self._run(_summarize_text, text, block_sep, url, title))
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
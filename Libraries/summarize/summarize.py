@@ -31,15 +31,28 @@
 from __future__ import print_function
 
 import codecs
-import nltk
-from nltk.corpus import stopwords
 import re
 import string
 import sys
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 _IS_PYTHON_3 = sys.version_info.major == 3
 
-stop_words = stopwords.words('english')
+stop_words = None  # Loaded by get_stop_words, so importing this module doesn't read the corpus.
+
+
+def get_stop_words():
+    global stop_words
+    if stop_words is None:
+        from nltk.corpus import stopwords
+        stop_words = frozenset(stopwords.words('english'))
+    return stop_words
+
+_PUNCTUATION = frozenset(['.', '!', ','])
 
 # The low end of shared words to consider
 LOWER_BOUND = .20
@@ -48,6 +61,9 @@ LOWER_BOUND = .20
 # duplicate sentence
 UPPER_BOUND = .90
 
+# Blocks with fewer sentences than this are scored in pure Python; below it NumPy's setup costs more than it saves.
+NUMPY_MIN_SENTS = 24
+
 
 def u(s):
     """Ensure our string is unicode independent of Python version, since Python 3 versions < 3.3 do not support the u"..." prefix"""
@@ -58,9 +74,12 @@ def u(s):
         return codecs.unicode_escape_decode(s)[0]
 
 
-def is_unimportant(word):
-    """Decides if a word is ok to toss out for the sentence comparisons"""
-    return word in ['.', '!', ',', ] or '\'' in word or word in stop_words
+def is_unimportant(word, stops=None):
+    """Decides if a word is ok to toss out for the sentence comparisons.
+    Callers checking many words can look up the stop words once and pass them as stops"""
+    if stops is None:
+        stops = get_stop_words()
+    return word in _PUNCTUATION or '\'' in word or word in stops
 
 
 def only_important(sent):
@@ -93,14 +112,76 @@ def compute_score(sent, sents):
     return sum(compare_sents_bounded(sent, sent1) for sent1 in sents) / float(len(sents))
 
 
+def important_word_ids(word_sents):
+    """Filter every sentence once, mapping its important words to integer ids.
+    Returns the set of ids for each sentence and the size of the vocabulary"""
+    stops = get_stop_words()
+    vocabulary = {}
+    id_sets = []
+    for sent in word_sents:
+        ids = set()
+        for word in sent:
+            if not is_unimportant(word, stops):
+                ids.add(vocabulary.setdefault(word, len(vocabulary)))
+        id_sets.append(ids)
+    return id_sets, len(vocabulary)
+
+
+def _score_sents_python(id_sets, lengths):
+    n = len(id_sets)
+    bounded = [[0] * n for _ in range(n)]
+    for i in range(n):
+        if not lengths[i]:
+            continue
+        for j in range(i, n):
+            if not lengths[j]:
+                continue
+            cmpd = len(id_sets[i] & id_sets[j]) / ((lengths[i] + lengths[j]) / 2.0)
+            if LOWER_BOUND < cmpd < UPPER_BOUND:
+                bounded[i][j] = bounded[j][i] = cmpd
+    # Summed in sentence order, like compute_score, so the results are identical.
+    return [sum(row) / float(n) if lengths[i] else 0 for i, row in enumerate(bounded)]
+
+
+def _score_sents_numpy(id_sets, vocabulary_size, lengths):
+    n = len(id_sets)
+    bag = numpy.zeros((n, vocabulary_size))
+    for i, ids in enumerate(id_sets):
+        bag[i, list(ids)] = 1
+    # shared[i, j] is the number of important words sentences i and j have in common.
+    shared = bag.dot(bag.T)
+    lengths = numpy.array(lengths)
+    denominators = (lengths[:, None] + lengths[None, :]) / 2.0
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        cmpd = numpy.where(denominators > 0, shared / denominators, 0)
+    cmpd[(cmpd <= LOWER_BOUND) | (cmpd >= UPPER_BOUND)] = 0
+    cmpd[lengths == 0, :] = 0
+    cmpd[:, lengths == 0] = 0
+    # cumsum adds left to right (unlike sum's pairwise summation), matching compute_score exactly.
+    scores = cmpd.cumsum(axis=1)[:, -1] / float(n)
+    return [float(score) if length else 0 for score, length in zip(scores, lengths)]
+
+
+def score_sents(word_sents):
+    """compute_score of every word-tokenized sentence against all of them,
+    tokenizing and filtering each sentence only once"""
+    if not word_sents:
+        return []
+    id_sets, vocabulary_size = important_word_ids(word_sents)
+    lengths = [len(sent) for sent in word_sents]
+    if numpy is not None and vocabulary_size and len(word_sents) >= NUMPY_MIN_SENTS:
+        return _score_sents_numpy(id_sets, vocabulary_size, lengths)
+    return _score_sents_python(id_sets, lengths)
+
+
 def summarize_block(block):
     """Return the sentence that best summarizes block"""
     if not block:
         return None
+    import nltk  # Here rather than at the top, so importing this module (or the pool) doesn't load NLTK.
     sents = nltk.sent_tokenize(block)
     word_sents = list(map(nltk.word_tokenize, sents))
-    d = dict((compute_score(word_sent, word_sents), sent)
-             for sent, word_sent in zip(sents, word_sents))
+    d = dict(zip(score_sents(word_sents), sents))
     return d[max(d.keys())]
 
 
@@ -140,13 +221,19 @@ def summarize_blocks(blocks):
 
 
 def summarize_page(url):
-    import bs4
     import requests
 
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2228.0 Safari/537.36',
     }
-    html = bs4.BeautifulSoup(requests.get(url, headers=headers).text)
+    return summarize_html(url, requests.get(url, headers=headers).text)
+
+
+def summarize_html(url, html):
+    """Summarize an already downloaded page, for callers that do their own fetching"""
+    import bs4
+
+    html = bs4.BeautifulSoup(html)
     b = find_likely_body(html)
     summaries = summarize_blocks(map(lambda p: p.text, b.find_all('p')))
     return Summary(url, b, html.title.text if html.title else None, summaries)
@@ -1,3 +1,4 @@
+import argparse
 import os
 
 base_config = '''{
@@ -31,18 +32,20 @@ base_config = '''{
   }
 }'''
 
-# TODO Factor in an arg parser.
 if __name__ == "__main__":
-    try:
-        import nltk
+    parser = argparse.ArgumentParser(description='Hangouts bot.')
+    parser.add_argument('--refresh-nltk-data', action='store_true',
+                        help='download any missing or damaged NLTK data (the URL summarizer needs it)')
+    args = parser.parse_args()
 
-        nltk.data.path.append("nltk_data")  # For Bots that have installed the nltk data in the root project dir.
+    # Checks the NLTK data in nltk_data without going online, unless it's missing and we've been asked to fetch it.
+    from Core.Util import NLTKData
 
-        # Keeps our words up to date for the URL summarizer.
-        nltk.download("stopwords")
-        nltk.download("punkt")
-    except ImportError:
+    nltk_status = NLTKData.ensure(refresh=args.refresh_nltk_data)
+    if 'no nltk' in nltk_status.values():
         print("nltk package is not installed. URL Summarizer will not work.")
+    elif not NLTKData.is_ready():
+        print("NLTK data is missing. URL Summarizer will not work.")
 
     command_char = '/'
 